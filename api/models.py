@@ -4,7 +4,6 @@ Pydantic models for API responses
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional, Any
 from datetime import datetime
-from decimal import Decimal
 
 class CryptoData(BaseModel):
     """Cryptocurrency data model"""
@@ -12,10 +11,10 @@ class CryptoData(BaseModel):
     source: str
     symbol: str
     name: Optional[str] = None
-    price_usd: Optional[Decimal] = None
-    market_cap_usd: Optional[Decimal] = None
-    volume_24h_usd: Optional[Decimal] = None
-    percent_change_24h: Optional[Decimal] = None
+    price_usd: Optional[float] = None
+    market_cap_usd: Optional[float] = None
+    volume_24h_usd: Optional[float] = None
+    percent_change_24h: Optional[float] = None
     rank: Optional[int] = None
     last_updated: Optional[datetime] = None
     ingested_at: datetime
@@ -26,10 +25,10 @@ class CryptoData(BaseModel):
 class DataResponse(BaseModel):
     """Response model for /data endpoint"""
     data: List[Dict[str, Any]]
-    total_records: int
-    page: int
+    page: Optional[int] = None
     page_size: int
-    total_pages: int
+    next_cursor: Optional[str] = None
+    has_more: bool
     filters: Dict[str, Any]
     request_id: str
     api_latency_ms: float
@@ -65,7 +64,7 @@ class ETLRun(BaseModel):
     records_processed: int
     start_time: datetime
     end_time: Optional[datetime] = None
-    duration_seconds: Optional[Decimal] = None
+    duration_seconds: Optional[float] = None
     error_message: Optional[str] = None
 
 class RunsResponse(BaseModel):
@@ -73,10 +72,4 @@ class RunsResponse(BaseModel):
     runs: List[Dict[str, Any]]
     count: int
     request_id: str
-    api_latency_ms: float
-
-class MetricsResponse(BaseModel):
-    """Response model for /metrics endpoint"""
-    metrics: str
-    timestamp: float
     api_latency_ms: float
\ No newline at end of file
@@ -0,0 +1,24 @@
+"""
+Response classes for API serialization
+"""
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+def _default(obj: Any) -> Any:
+    """Fallback encoder for types orjson does not handle natively"""
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson instead of stdlib json"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=_default,
+            option=orjson.OPT_NON_STR_KEYS
+        )
@@ -0,0 +1,56 @@
+"""
+In-process TTL cache for async read paths
+"""
+from typing import Any, Callable, Dict, Hashable, Tuple
+import asyncio
+import functools
+import time
+
+def async_ttl_cache(ttl: float) -> Callable:
+    """
+    Cache an async method's result per argument tuple for ttl seconds.
+    
+    The instance is not part of the key, so copies of a service (such as
+    the bound ones from DatabaseService.transaction) share entries.
+    Concurrent misses for one key share a single underlying call; hits and
+    other keys never wait on it. The wrapper gains cache_clear() for
+    explicit invalidation.
+    """
+    def decorator(func: Callable) -> Callable:
+        # key -> (monotonic time cached, result)
+        cache: Dict[Hashable, Tuple[float, Any]] = {}
+        # key -> underlying call in flight for a miss
+        pending: Dict[Hashable, asyncio.Future] = {}
+        # Bumped by cache_clear so calls started before it aren't stored
+        generation = 0
+        
+        @functools.wraps(func)
+        async def wrapper(instance, *args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            hit = cache.get(key)
+            if hit is not None and time.monotonic() - hit[0] < ttl:
+                return hit[1]
+            
+            call = pending.get(key)
+            if call is None:
+                call = asyncio.ensure_future(func(instance, *args, **kwargs))
+                pending[key] = call
+                call.add_done_callback(functools.partial(store, key, generation))
+            # A caller that gives up doesn't cancel the call for the others
+            return await asyncio.shield(call)
+        
+        def store(key: Hashable, started_in: int, call: asyncio.Future):
+            if pending.get(key) is call:
+                del pending[key]
+            if started_in == generation and not call.cancelled() and call.exception() is None:
+                cache[key] = (time.monotonic(), call.result())
+        
+        def cache_clear():
+            nonlocal generation
+            generation += 1
+            cache.clear()
+            pending.clear()
+        
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
@@ -3,6 +3,7 @@ Configuration management using Pydantic Settings
 """
 from pydantic_settings import BaseSettings
 from typing import Optional
+from functools import cached_property
 import os
 
 class Settings(BaseSettings):
@@ -12,6 +13,7 @@ class Settings(BaseSettings):
     APP_NAME: str = "Kasparro Backend ETL"
     DEBUG: bool = False
     RUN_ETL_ON_STARTUP: bool = True
+    API_WORKERS: int = 1  # uvicorn worker processes; each runs the startup ETL
     
     # Database
     POSTGRES_USER: str = "postgres"
@@ -20,10 +22,19 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str = "db"
     POSTGRES_PORT: int = 5432
     
-    @property
+    @cached_property
     def DATABASE_URL(self) -> str:
+        # Settings are frozen, so the URL is built once and reused
         return f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
     
+    # Database Pool
+    DB_POOL_MIN_SIZE: int = 5  # connections kept warm
+    DB_POOL_MAX_SIZE: int = 20
+    DB_STATEMENT_CACHE_SIZE: int = 1024  # prepared statements cached per connection
+    
+    # Raw Data Archive
+    RAW_PARTITION_MONTHS_AHEAD: int = 3  # monthly partitions created ahead at startup
+    
     # API Keys
     COINPAPRIKA_API_KEY: Optional[str] = None
     COINGECKO_API_KEY: Optional[str] = None
@@ -32,12 +43,21 @@ class Settings(BaseSettings):
     ETL_BATCH_SIZE: int = 100
     ETL_MAX_RETRIES: int = 3
     ETL_RETRY_DELAY: int = 5  # seconds
+    ETL_QUEUE_SIZE: int = 4  # extracted batches buffered ahead of transform/load
+    
+    # HTTP Client
+    HTTP_POOL_LIMIT: int = 20  # max open connections
+    HTTP_DNS_CACHE_TTL: int = 300  # seconds
     
     # Rate Limiting
     RATE_LIMIT_ENABLED: bool = True
     COINPAPRIKA_RATE_LIMIT: int = 25  # requests per minute
     COINGECKO_RATE_LIMIT: int = 50  # requests per minute
     
+    # CoinGecko Pagination
+    COINGECKO_PAGES: int = 1  # 100 coins per page
+    COINGECKO_PAGE_CONCURRENCY: int = 5  # pages fetched in parallel
+    
     # Backoff Configuration
     BACKOFF_BASE_DELAY: float = 1.0  # seconds
     BACKOFF_MAX_DELAY: float = 60.0  # seconds
@@ -54,12 +74,17 @@ class Settings(BaseSettings):
     # Observability
     LOG_LEVEL: str = "INFO"
     LOG_FORMAT: str = "json"  # or "text"
+    STATS_CACHE_TTL: float = 30.0  # seconds /stats and /metrics reuse ETL stats
+    RUNS_CACHE_TTL: float = 10.0  # seconds /runs reuses the run history
     
     # CSV Data Source
     CSV_FILE_PATH: str = "/app/data/crypto_data.csv"
+    CSV_CHUNK_SIZE: int = 100_000  # rows transformed and loaded per batch
     
     class Config:
         env_file = ".env"
         case_sensitive = True
+        # Read-only after load; also makes the cached DATABASE_URL safe
+        frozen = True
 
 settings = Settings()
\ No newline at end of file
@@ -1,18 +1,21 @@
 """
 Structured logging setup with JSON support
 """
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
-import json
-from datetime import datetime
+from datetime import datetime, timezone
+import orjson
 from core.config import settings
 
 class JSONFormatter(logging.Formatter):
-    """Custom JSON formatter for structured logging"""
+    """Custom JSON formatter for structured logging (orjson-backed)"""
     
     def format(self, record):
         log_data = {
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc),
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
@@ -25,18 +28,34 @@ class JSONFormatter(logging.Formatter):
             log_data["exception"] = self.formatException(record.exc_info)
         
         # Add extra fields
-        if hasattr(record, 'extra'):
-            log_data.update(record.extra)
+        extra = getattr(record, 'extra', None)
+        if extra:
+            log_data.update(extra)
         
-        return json.dumps(log_data)
+        # orjson serializes datetimes natively; default=str covers odd extras
+        return orjson.dumps(log_data, default=str, option=orjson.OPT_UTC_Z).decode()
 
-def setup_logger(name: str) -> logging.Logger:
-    """Setup logger with appropriate formatter"""
-    logger = logging.getLogger(name)
-    logger.setLevel(getattr(logging, settings.LOG_LEVEL.upper()))
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves message/args formatting to the listener thread"""
+    
+    def prepare(self, record):
+        # The stock QueueHandler formats the message here, on the caller's
+        # thread; we enqueue the record untouched and format on dequeue.
+        return record
+
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_listener = None
+
+def configure_logging() -> None:
+    """
+    Attach the queue handler to the root logger (idempotent).
     
-    # Remove existing handlers
-    logger.handlers.clear()
+    Every module logger propagates to root, so there is exactly one
+    handler/formatter pair and one background writer per process.
+    """
+    global _listener
+    if _listener is not None:
+        return
     
     handler = logging.StreamHandler(sys.stdout)
     
@@ -48,7 +67,20 @@ def setup_logger(name: str) -> logging.Logger:
         )
         handler.setFormatter(formatter)
     
-    logger.addHandler(handler)
-    logger.propagate = False
+    _listener = logging.handlers.QueueListener(_log_queue, handler)
+    _listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(_listener.stop)
+    
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, settings.LOG_LEVEL.upper()))
+    root.addHandler(DeferredQueueHandler(_log_queue))
+
+def setup_logger(name: str) -> logging.Logger:
+    """Get a module logger; output goes through the shared root handler"""
+    configure_logging()
+    
+    logger = logging.getLogger(name)
+    logger.propagate = True
     
-    return logger
\ No newline at end of file
+    return logger
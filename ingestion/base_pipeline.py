@@ -2,23 +2,67 @@
 Base ETL Pipeline with common functionality
 """
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
-from datetime import datetime
+from contextlib import aclosing, asynccontextmanager, suppress
+from typing import List, Dict, Any, AsyncIterator, Tuple, FrozenSet, Optional
+import asyncio
+import time
 from difflib import SequenceMatcher
+from pydantic import TypeAdapter, ValidationError
+import aiohttp
 
 from services.database import DatabaseService
+from services.http_client import create_http_session
 from core.config import settings
 from core.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+def _normalize_key(key: str) -> str:
+    """Case- and separator-insensitive spelling of a field name"""
+    return key.replace("_", "").replace("-", "").lower()
+
 class BasePipeline(ABC):
     """Abstract base class for ETL pipelines"""
     
     SOURCE_NAME = "base"
     
-    def __init__(self, db: DatabaseService):
+    # Expected field -> type (or tuple of types) used for drift detection
+    EXPECTED_SCHEMA: Dict[str, Any] = {}
+    EXPECTED_KEYS: FrozenSet[str] = frozenset()
+    EXPECTED_TYPE_NAMES: Dict[str, str] = {}
+    
+    # Known upstream name -> expected field, checked before fuzzy matching
+    FIELD_ALIASES: Dict[str, str] = {}
+    # Normalized spelling (see _normalize_key) -> expected field
+    CANONICAL_KEYS: Dict[str, str] = {}
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Derived once per class instead of on every drift check
+        cls.EXPECTED_KEYS = frozenset(cls.EXPECTED_SCHEMA)
+        cls.EXPECTED_TYPE_NAMES = {
+            key: "|".join(t.__name__ for t in (types if isinstance(types, tuple) else (types,)))
+            for key, types in cls.EXPECTED_SCHEMA.items()
+        }
+        cls.CANONICAL_KEYS = {
+            **{_normalize_key(alias): key for alias, key in cls.FIELD_ALIASES.items()},
+            **{_normalize_key(key): key for key in cls.EXPECTED_SCHEMA},
+        }
+    
+    def __init__(self, db: DatabaseService, session: Optional[aiohttp.ClientSession] = None):
         self.db = db
+        self.session = session
+        # Key/type signature of the last sample checked for drift
+        self._last_drift_signature: Optional[FrozenSet[Tuple[str, type]]] = None
+    
+    @asynccontextmanager
+    async def http_session(self):
+        """Yield the shared HTTP session, or a temporary one if none was provided"""
+        if self.session is not None and not self.session.closed:
+            yield self.session
+        else:
+            async with create_http_session() as session:
+                yield session
     
     @abstractmethod
     async def extract(self) -> List[Dict]:
@@ -35,67 +79,156 @@ class BasePipeline(ABC):
         """Load data into database"""
         pass
     
-    @abstractmethod
-    def get_expected_schema(self) -> Dict:
-        """Get expected schema for this source"""
+    async def extract_batches(self) -> AsyncIterator[List[Dict]]:
+        """
+        Yield raw records in batches.
+        
+        Defaults to a single batch from extract(); sources that can stream
+        override this so each batch is transformed and loaded as it arrives.
+        """
+        yield await self.extract()
+    
+    async def finish_extraction(self):
+        """
+        Called by run() once every batch has been loaded.
+        
+        Empty batches never reach load(), so sources that checkpoint per
+        batch override this to close the run's checkpoint.
+        """
         pass
     
-    async def run(self) -> Dict[str, Any]:
-        """Run the complete ETL pipeline"""
-        start_time = datetime.now()
+    async def run(self, refresh_stats: bool = False) -> Dict[str, Any]:
+        """
+        Run the complete ETL pipeline.
+        
+        With refresh_stats the per-source counts behind /stats are
+        refreshed after a successful run. The orchestrator refreshes once
+        for all sources instead, so callers running a single pipeline opt in.
+        """
+        # The run log is timestamped by the database; the returned duration
+        # uses the monotonic clock
+        start_perf = time.perf_counter()
+        raw_count = 0
+        records_processed = 0
+        
+        # One etl_runs row per run, updated in place when it finishes
+        run_id = await self.db.start_run(self.SOURCE_NAME)
+        
+        # Extraction runs ahead in its own task while batches are transformed
+        # and loaded here; the bounded queue caps how far it gets ahead
+        queue: asyncio.Queue = asyncio.Queue(maxsize=settings.ETL_QUEUE_SIZE)
+        producer = asyncio.create_task(self._produce_batches(queue))
         
         try:
-            # Extract
-            raw_data = await self.extract()
+            while (raw_data := await queue.get()) is not None:
+                if isinstance(raw_data, Exception):
+                    raise raw_data
+                
+                # Transform
+                normalized_data = await self.transform(raw_data)
+                
+                # Load
+                await self.load(normalized_data)
+                
+                raw_count += len(raw_data)
+                records_processed += len(normalized_data)
             
-            if not raw_data:
+            if not raw_count:
                 logger.warning(f"No data extracted from {self.SOURCE_NAME}")
-                return {
-                    "status": "success",
-                    "records_processed": 0,
-                    "duration": 0
-                }
             
-            # Transform
-            normalized_data = await self.transform(raw_data)
+            await self.finish_extraction()
             
-            # Load
-            await self.load(normalized_data)
-            
-            end_time = datetime.now()
-            duration = (end_time - start_time).total_seconds()
+            duration = time.perf_counter() - start_perf
             
             # Log successful run
-            await self.db.log_run(
-                source=self.SOURCE_NAME,
+            await self.db.finish_run(
+                run_id,
                 status="success",
-                records=len(normalized_data),
-                start_time=start_time,
-                end_time=end_time,
-                metadata={"raw_count": len(raw_data)}
+                records=records_processed,
+                metadata={"raw_count": raw_count}
             )
             
+            # After finish_run, so the refresh isn't counted in the run's duration
+            if refresh_stats:
+                await self._refresh_stats()
+            
             return {
                 "status": "success",
-                "records_processed": len(normalized_data),
+                "records_processed": records_processed,
                 "duration": duration
             }
         
         except Exception as e:
-            end_time = datetime.now()
             logger.error(f"Pipeline failed for {self.SOURCE_NAME}: {e}")
             
-            # Log failed run
-            await self.db.log_run(
-                source=self.SOURCE_NAME,
+            # Log failed run; earlier batches were committed in their own
+            # transactions, so they count
+            await self.db.finish_run(
+                run_id,
                 status="failed",
-                records=0,
-                start_time=start_time,
-                end_time=end_time,
+                records=records_processed,
                 error=str(e)
             )
             
             raise
+        
+        except asyncio.CancelledError:
+            # e.g. shutdown during the startup ETL; without this the run
+            # would stay 'running' forever
+            logger.warning(f"Pipeline cancelled for {self.SOURCE_NAME}")
+            await self.db.finish_run(
+                run_id,
+                status="failed",
+                records=records_processed,
+                error="Run cancelled"
+            )
+            raise
+        
+        finally:
+            # Stop extracting if loading ended early, and wait for the
+            # producer (and any fetches it started) to wind down
+            producer.cancel()
+            with suppress(asyncio.CancelledError):
+                await producer
+    
+    async def _produce_batches(self, queue: asyncio.Queue):
+        """Feed extracted batches to run(), then None; an extract error is passed on in its place"""
+        try:
+            # aclosing runs the generator's cleanup even when cancelled
+            # between batches, not only mid-fetch
+            async with aclosing(self.extract_batches()) as batches:
+                async for raw_data in batches:
+                    if raw_data:
+                        await queue.put(raw_data)
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(None)
+    
+    async def _refresh_stats(self):
+        """Refresh the per-source counts; a failure here doesn't fail the run"""
+        try:
+            await self.db.refresh_stats()
+        except Exception as e:
+            logger.error(f"Failed to refresh ETL stats for {self.SOURCE_NAME}: {e}")
+    
+    def validate_records(self, adapter: TypeAdapter, raw_data: List[Dict]) -> List[Tuple[Any, Dict]]:
+        """
+        Validate a whole batch with a single pydantic-core call.
+        
+        Returns (validated, raw) pairs; rows that fail validation are skipped.
+        """
+        try:
+            return list(zip(adapter.validate_python(raw_data), raw_data))
+        except ValidationError as e:
+            # Error locations start with the row index - drop only those rows
+            bad_rows = {err['loc'][0] for err in e.errors() if err['loc']}
+            logger.warning(
+                f"Skipping {len(bad_rows)} invalid records from {self.SOURCE_NAME} "
+                f"({e.error_count()} validation errors)"
+            )
+            valid = [item for idx, item in enumerate(raw_data) if idx not in bad_rows]
+            return list(zip(adapter.validate_python(valid), valid))
     
     async def calculate_backoff(self, retry_count: int) -> float:
         """Calculate exponential backoff delay"""
@@ -108,24 +241,52 @@ class BasePipeline(ABC):
     
     async def detect_schema_drift(self, sample_data: Dict):
         """Detect schema drift using fuzzy matching"""
-        expected_schema = self.get_expected_schema()
-        actual_keys = set(sample_data.keys())
-        expected_keys = set(expected_schema.keys())
+        # Schemas rarely change between runs - skip the comparison entirely
+        # when the sample's keys and value types match the last one checked
+        signature = frozenset((key, type(value)) for key, value in sample_data.items())
+        if signature == self._last_drift_signature:
+            return
+        self._last_drift_signature = signature
+        
+        expected_schema = self.EXPECTED_SCHEMA
+        # The keys view supports set operations directly - no copy needed
+        actual_keys = sample_data.keys()
+        expected_keys = self.EXPECTED_KEYS
         
         # Calculate confidence score
         missing_keys = expected_keys - actual_keys
         extra_keys = actual_keys - expected_keys
+        present_keys = expected_keys & actual_keys
         
-        # Fuzzy match for renamed fields
         warnings = []
         fuzzy_matches = {}
         
-        for missing_key in missing_keys:
+        # Known aliases and case/separator variants resolve with a dict probe
+        candidates = []
+        for actual_key in extra_keys:
+            canonical = self.CANONICAL_KEYS.get(_normalize_key(actual_key))
+            if canonical in missing_keys and canonical not in fuzzy_matches:
+                fuzzy_matches[canonical] = (actual_key, 1.0)
+                warnings.append(f"Field rename: '{canonical}' -> '{actual_key}' (known alias)")
+            else:
+                candidates.append(actual_key)
+        
+        # Fuzzy match the remaining fields; SequenceMatcher caches its
+        # analysis of seq2, so set the missing key once and only swap the
+        # candidate in as seq1
+        matcher = SequenceMatcher()
+        
+        for missing_key in missing_keys - fuzzy_matches.keys():
             best_match = None
             best_score = 0
+            matcher.set_seq2(missing_key)
             
-            for actual_key in extra_keys:
-                score = SequenceMatcher(None, missing_key, actual_key).ratio()
+            for actual_key in candidates:
+                matcher.set_seq1(actual_key)
+                # Cheap upper bounds first; skip the full ratio if it can't win
+                if matcher.real_quick_ratio() <= best_score or matcher.quick_ratio() <= best_score:
+                    continue
+                score = matcher.ratio()
                 if score > best_score:
                     best_score = score
                     best_match = actual_key
@@ -137,24 +298,19 @@ class BasePipeline(ABC):
                 )
         
         # Check for type mismatches
-        for key in expected_keys & actual_keys:
+        for key in present_keys:
             expected_type = expected_schema[key]
             actual_value = sample_data[key]
             
-            if actual_value is not None:
-                if isinstance(expected_type, tuple):
-                    type_match = any(isinstance(actual_value, t) for t in expected_type)
-                else:
-                    type_match = isinstance(actual_value, expected_type)
-                
-                if not type_match:
-                    warnings.append(
-                        f"Type mismatch for '{key}': expected {expected_type}, got {type(actual_value).__name__}"
-                    )
+            # isinstance accepts a single type or a tuple of types
+            if actual_value is not None and not isinstance(actual_value, expected_type):
+                warnings.append(
+                    f"Type mismatch for '{key}': expected {expected_type}, got {type(actual_value).__name__}"
+                )
         
         # Calculate overall confidence
         total_expected = len(expected_keys)
-        matched = len(expected_keys & actual_keys) + len(fuzzy_matches)
+        matched = len(present_keys) + len(fuzzy_matches)
         confidence = matched / total_expected if total_expected > 0 else 1.0
         
         # Log drift if detected
@@ -165,7 +321,7 @@ class BasePipeline(ABC):
             
             await self.db.log_schema_drift(
                 source=self.SOURCE_NAME,
-                expected=expected_schema,
+                expected=self.EXPECTED_TYPE_NAMES,
                 actual={k: type(v).__name__ for k, v in sample_data.items()},
                 confidence=confidence,
                 warnings=warnings
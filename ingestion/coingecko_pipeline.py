@@ -3,12 +3,14 @@ CoinGecko API ETL Pipeline - FIXED VERSION
 """
 import aiohttp
 import asyncio
+from collections import deque
 from datetime import datetime
-from typing import List, Dict
-from pydantic import BaseModel, ValidationError
-from decimal import Decimal
+from typing import AsyncIterator, Deque, List, Dict, Optional
+from pydantic import BaseModel, NonNegativeFloat, TypeAdapter
+import orjson
 
 from ingestion.base_pipeline import BasePipeline
+from ingestion.rate_limiter import AsyncRateLimiter
 from core.config import settings
 from core.logger import setup_logger
 
@@ -16,17 +18,26 @@ logger = setup_logger(__name__)
 
 class CoinGeckoData(BaseModel):
     """Validation model for CoinGecko data"""
-    id: str
-    symbol: str
-    name: str
-    current_price: float
-    market_cap: float
-    total_volume: float
-    price_change_percentage_24h: float
-    market_cap_rank: int
+    id: str = ""
+    symbol: str = ""
+    name: str = ""
+    # CoinGecko returns null for some numeric fields and those normalize
+    # to 0; negative amounts fail validation rather than the DB CHECKs
+    current_price: Optional[NonNegativeFloat] = None
+    market_cap: Optional[NonNegativeFloat] = None
+    total_volume: Optional[NonNegativeFloat] = None
+    price_change_percentage_24h: Optional[float] = None
+    market_cap_rank: Optional[int] = 0
     
     class Config:
-        extra = "allow"
+        # Undeclared fields are not copied onto the model; the raw record
+        # is kept alongside for storage
+        extra = "ignore"
+
+ZERO = 0.0
+
+# Built once at import; validates a whole page in a single call
+_ADAPTER = TypeAdapter(List[CoinGeckoData])
 
 class CoinGeckoPipeline(BasePipeline):
     """ETL pipeline for CoinGecko API"""
@@ -34,54 +45,116 @@ class CoinGeckoPipeline(BasePipeline):
     SOURCE_NAME = "coingecko"
     BASE_URL = "https://api.coingecko.com/api/v3"
     
-    def __init__(self, db):
-        super().__init__(db)
+    EXPECTED_SCHEMA = {
+        "id": str,
+        "symbol": str,
+        "name": str,
+        "current_price": (int, float),
+        "market_cap": (int, float),
+        "total_volume": (int, float),
+        "price_change_percentage_24h": (int, float),
+        "market_cap_rank": int
+    }
+    
+    FIELD_ALIASES = {
+        "ticker": "symbol",
+        "price": "current_price",
+        "volume_24h": "total_volume",
+        "rank": "market_cap_rank"
+    }
+    
+    def __init__(self, db, session=None):
+        super().__init__(db, session)
         self.api_key = settings.COINGECKO_API_KEY
         self.rate_limit = settings.COINGECKO_RATE_LIMIT
+        self.limiter = AsyncRateLimiter(self.rate_limit, 60)
+        # Progress of the current run, recorded in each page's checkpoint.
+        # run() skips empty pages, so extraction queues the page number of
+        # each page it hands over for load() to pick up in order
+        self._pages_to_load: Deque[int] = deque()
+        self._last_page_loaded = 0
+        self._records_loaded = 0
     
     async def extract(self) -> List[Dict]:
         """Extract data from CoinGecko API"""
+        all_data = [record async for page in self.extract_batches() for record in page]
+        logger.info(f"Extracted {len(all_data)} records from {self.SOURCE_NAME}")
+        return all_data
+    
+    async def extract_batches(self) -> AsyncIterator[List[Dict]]:
+        """
+        Yield pages in order as they arrive.
+        
+        All pages are fetched concurrently up front, so loading one page
+        overlaps the remaining fetches.
+        """
         logger.info(f"Extracting data from {self.SOURCE_NAME}")
+        self._pages_to_load.clear()
+        self._last_page_loaded = 0
+        self._records_loaded = 0
         
+        async with self.http_session() as session:
+            fetches = self._start_page_fetches(session)
+            try:
+                for page, fetch in enumerate(fetches, 1):
+                    data = await fetch
+                    if data:
+                        self._pages_to_load.append(page)
+                    yield data
+            finally:
+                for fetch in fetches:
+                    fetch.cancel()
+    
+    def _start_page_fetches(self, session: aiohttp.ClientSession) -> List[asyncio.Task]:
+        """Start fetching every configured page, in page order"""
         headers = {}
         if self.api_key:
             headers['x-cg-demo-api-key'] = self.api_key
         
-        all_data = []
+        # Pages are fetched concurrently; the limiter still paces requests
+        semaphore = asyncio.Semaphore(settings.COINGECKO_PAGE_CONCURRENCY)
+        
+        async def fetch_bounded(page):
+            async with semaphore:
+                return await self._fetch_page(session, headers, page)
+        
+        return [
+            asyncio.create_task(fetch_bounded(page))
+            for page in range(1, settings.COINGECKO_PAGES + 1)
+        ]
+    
+    async def _fetch_page(self, session: aiohttp.ClientSession, headers: Dict, page: int) -> List[Dict]:
+        """Fetch a single markets page, retrying with backoff"""
         retry_count = 0
         
         while retry_count < settings.ETL_MAX_RETRIES:
             try:
-                async with aiohttp.ClientSession() as session:
-                    url = f"{self.BASE_URL}/coins/markets"
-                    params = {
-                        "vs_currency": "usd",
-                        "order": "market_cap_desc",
-                        "per_page": 100,
-                        "page": 1,
-                        "sparkline": False,
-                        "locale": "en"  # Added to ensure consistent response
-                    }
-                    
-                    # Apply rate limiting
-                    if settings.RATE_LIMIT_ENABLED:
-                        await asyncio.sleep(60 / self.rate_limit)
+                url = f"{self.BASE_URL}/coins/markets"
+                params = {
+                    "vs_currency": "usd",
+                    "order": "market_cap_desc",
+                    "per_page": 100,
+                    "page": page,
+                    "sparkline": False,
+                    "locale": "en"  # Added to ensure consistent response
+                }
+                
+                # Apply rate limiting
+                if settings.RATE_LIMIT_ENABLED:
+                    await self.limiter.acquire()
+                
+                async with session.get(url, headers=headers, params=params) as response:
+                    if response.status == 429:
+                        logger.warning("Rate limited, applying exponential backoff")
+                        delay = await self.calculate_backoff(retry_count)
+                        await asyncio.sleep(delay)
+                        retry_count += 1
+                        continue
                     
-                    async with session.get(url, headers=headers, params=params) as response:
-                        if response.status == 429:
-                            logger.warning("Rate limited, applying exponential backoff")
-                            delay = await self.calculate_backoff(retry_count)
-                            await asyncio.sleep(delay)
-                            retry_count += 1
-                            continue
-                        
-                        response.raise_for_status()
-                        data = await response.json()
-                        all_data = data
-                        
-                        logger.info(f"Extracted {len(all_data)} records from {self.SOURCE_NAME}")
-                        return all_data
-            
+                    response.raise_for_status()
+                    # orjson parses the raw body faster than the stdlib json.loads
+                    return orjson.loads(await response.read())
+        
             except aiohttp.ClientError as e:
                 logger.error(f"HTTP error: {e}")
                 retry_count += 1
@@ -101,106 +174,64 @@ class CoinGeckoPipeline(BasePipeline):
         if settings.SCHEMA_DRIFT_ENABLED and raw_data:
             await self.detect_schema_drift(raw_data[0])
         
-        normalized_records = []
+        # Per-batch constants, bound once rather than per record
+        now = datetime.now()
+        source = self.SOURCE_NAME
         
-        for item in raw_data:
-            try:
-                # Handle None values and type conversions
-                # FIXED: Convert None to 0 for numeric fields
-                current_price = float(item.get('current_price') or 0)
-                market_cap = float(item.get('market_cap') or 0)
-                total_volume = float(item.get('total_volume') or 0)
-                price_change_24h = float(item.get('price_change_percentage_24h') or 0)
-                market_cap_rank = int(item.get('market_cap_rank') or 0)
-                
-                # Validate with Pydantic
-                validated = CoinGeckoData(
-                    id=item.get('id', ''),
-                    symbol=item.get('symbol', ''),
-                    name=item.get('name', ''),
-                    current_price=current_price,
-                    market_cap=market_cap,
-                    total_volume=total_volume,
-                    price_change_percentage_24h=price_change_24h,
-                    market_cap_rank=market_cap_rank
-                )
-                
-                normalized = {
-                    "source": self.SOURCE_NAME,
-                    "symbol": validated.symbol.upper(),
-                    "name": validated.name,
-                    "price_usd": Decimal(str(validated.current_price)),
-                    "market_cap_usd": Decimal(str(validated.market_cap)),
-                    "volume_24h_usd": Decimal(str(validated.total_volume)),
-                    "percent_change_24h": Decimal(str(validated.price_change_percentage_24h)),
-                    "rank": validated.market_cap_rank,
-                    "last_updated": datetime.now(),
-                    "raw_data": item
-                }
-                
-                normalized_records.append(normalized)
-                
-            except ValidationError as e:
-                logger.warning(f"Validation error for record {item.get('id', 'unknown')}: {e}")
-                continue
-            except Exception as e:
-                logger.error(f"Transform error for record {item.get('id', 'unknown')}: {e}")
-                continue
+        normalized_records = [
+            {
+                "source": source,
+                "symbol": validated.symbol.upper(),
+                "name": validated.name,
+                "price_usd": validated.current_price or ZERO,
+                "market_cap_usd": validated.market_cap or ZERO,
+                "volume_24h_usd": validated.total_volume or ZERO,
+                "percent_change_24h": validated.price_change_percentage_24h or ZERO,
+                "rank": validated.market_cap_rank or 0,
+                "last_updated": now,
+                # Serialized once here and handed to the DB as-is
+                "raw_bytes": orjson.dumps(item)
+            }
+            for validated, item in self.validate_records(_ADAPTER, raw_data)
+        ]
         
         logger.info(f"Transformed {len(normalized_records)} valid records")
         return normalized_records
     
     async def load(self, normalized_data: List[Dict]):
-        """Load data into database with checkpointing"""
+        """Load one page into the database with checkpointing"""
         logger.info(f"Loading {len(normalized_data)} records to database")
         
-        # Save raw data first
-        await self.db.save_raw_data(
-            source=self.SOURCE_NAME,
-            data=[r['raw_data'] for r in normalized_data],
-            source_ids=[r['symbol'] for r in normalized_data]
-        )
+        total_loaded = len(normalized_data)
+        page = self._pages_to_load.popleft() if self._pages_to_load else self._last_page_loaded + 1
+        offset = self._records_loaded + total_loaded
         
-        # Batch load with checkpointing
-        batch_size = settings.CHECKPOINT_INTERVAL
-        total_loaded = 0
-        
-        for i in range(0, len(normalized_data), batch_size):
-            batch = normalized_data[i:i + batch_size]
+        # Raw, normalized and checkpoint writes share one connection and
+        # commit together
+        async with self.db.transaction() as tx:
+            # Save raw data first (one pass builds the payload/id pairs)
+            await tx.save_raw_data(
+                source=self.SOURCE_NAME,
+                rows=[(r['raw_bytes'], r['symbol']) for r in normalized_data]
+            )
             
-            try:
-                await self.db.save_normalized_data(batch)
-                total_loaded += len(batch)
-                
-                # Save checkpoint
-                if settings.CHECKPOINT_ENABLED:
-                    await self.db.save_checkpoint(
-                        source=self.SOURCE_NAME,
-                        checkpoint_data={"last_index": i + batch_size},
-                        records_processed=total_loaded
-                    )
-                
-                logger.info(f"Loaded batch: {total_loaded}/{len(normalized_data)} records")
-                
-            except Exception as e:
-                logger.error(f"Error loading batch: {e}")
-                raise
-        
-        # Mark checkpoint as completed
-        if settings.CHECKPOINT_ENABLED:
-            await self.db.mark_checkpoint_completed(self.SOURCE_NAME)
+            # Single COPY-backed write for the whole batch
+            await tx.save_normalized_data(normalized_data)
+            
+            # Record how far the run got; only the last page completes it
+            if settings.CHECKPOINT_ENABLED:
+                await tx.save_checkpoint(
+                    source=self.SOURCE_NAME,
+                    checkpoint_data={"last_page": page, "last_index": offset},
+                    records_processed=offset,
+                    completed=page >= settings.COINGECKO_PAGES
+                )
         
-        logger.info(f"Successfully loaded {total_loaded} records")
+        self._last_page_loaded = page
+        self._records_loaded = offset
+        logger.info(f"Successfully loaded {total_loaded} records (page {page})")
     
-    def get_expected_schema(self) -> Dict:
-        """Get expected schema for drift detection"""
-        return {
-            "id": str,
-            "symbol": str,
-            "name": str,
-            "current_price": (int, float),
-            "market_cap": (int, float),
-            "total_volume": (int, float),
-            "price_change_percentage_24h": (int, float),
-            "market_cap_rank": int
-        }
+    async def finish_extraction(self):
+        """Close the run's checkpoint when the last pages came back empty"""
+        if settings.CHECKPOINT_ENABLED and self._last_page_loaded < settings.COINGECKO_PAGES:
+            await self.db.mark_checkpoint_completed(self.SOURCE_NAME)
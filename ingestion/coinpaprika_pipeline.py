@@ -4,26 +4,46 @@ CoinPaprika API ETL Pipeline with rate limiting and backoff
 import aiohttp
 import asyncio
 from datetime import datetime
+from operator import attrgetter
 from typing import List, Dict, Optional
-from pydantic import BaseModel, Field, ValidationError
-from decimal import Decimal
+from pydantic import BaseModel, NonNegativeFloat, TypeAdapter
+import orjson
 
 from ingestion.base_pipeline import BasePipeline
+from ingestion.rate_limiter import AsyncRateLimiter
 from core.config import settings
 from core.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+class CoinPaprikaQuote(BaseModel):
+    """Validation model for a CoinPaprika quote"""
+    price: Optional[NonNegativeFloat] = None
+    market_cap: Optional[NonNegativeFloat] = None
+    volume_24h: Optional[NonNegativeFloat] = None
+    percent_change_24h: Optional[float] = None
+
 class CoinPaprikaData(BaseModel):
     """Validation model for CoinPaprika data"""
     id: str
     name: str
     symbol: str
     rank: int
-    quotes: Dict
+    quotes: Dict[str, CoinPaprikaQuote]
     
     class Config:
-        extra = "allow"
+        # Undeclared fields are not copied onto the model; the raw record
+        # is kept alongside for storage
+        extra = "ignore"
+
+ZERO = 0.0
+EMPTY_QUOTE = CoinPaprikaQuote()
+
+# Pulls every normalized USD quote field in a single C-level call
+_GET_USD_FIELDS = attrgetter('price', 'market_cap', 'volume_24h', 'percent_change_24h')
+
+# Built once at import; validates the whole ticker list in a single call
+_ADAPTER = TypeAdapter(List[CoinPaprikaData])
 
 class CoinPaprikaPipeline(BasePipeline):
     """ETL pipeline for CoinPaprika API"""
@@ -31,10 +51,26 @@ class CoinPaprikaPipeline(BasePipeline):
     SOURCE_NAME = "coinpaprika"
     BASE_URL = "https://api.coinpaprika.com/v1"
     
-    def __init__(self, db):
-        super().__init__(db)
+    EXPECTED_SCHEMA = {
+        "id": str,
+        "name": str,
+        "symbol": str,
+        "rank": int,
+        "quotes": dict
+    }
+    
+    FIELD_ALIASES = {
+        "ticker": "symbol",
+        "coin": "name",
+        "market_cap_rank": "rank",
+        "quote": "quotes"
+    }
+    
+    def __init__(self, db, session=None):
+        super().__init__(db, session)
         self.api_key = settings.COINPAPRIKA_API_KEY
         self.rate_limit = settings.COINPAPRIKA_RATE_LIMIT
+        self.limiter = AsyncRateLimiter(self.rate_limit, 60)
     
     async def extract(self) -> List[Dict]:
         """Extract data from CoinPaprika API"""
@@ -52,15 +88,15 @@ class CoinPaprikaPipeline(BasePipeline):
         all_data = []
         retry_count = 0
         
-        while retry_count < settings.ETL_MAX_RETRIES:
-            try:
-                async with aiohttp.ClientSession() as session:
+        async with self.http_session() as session:
+            while retry_count < settings.ETL_MAX_RETRIES:
+                try:
                     # Get ticker data
                     url = f"{self.BASE_URL}/tickers"
                     
                     # Apply rate limiting
                     if settings.RATE_LIMIT_ENABLED:
-                        await asyncio.sleep(60 / self.rate_limit)
+                        await self.limiter.acquire()
                     
                     async with session.get(url, headers=headers) as response:
                         if response.status == 429:  # Rate limited
@@ -71,7 +107,8 @@ class CoinPaprikaPipeline(BasePipeline):
                             continue
                         
                         response.raise_for_status()
-                        data = await response.json()
+                        # orjson parses the raw body faster than the stdlib json.loads
+                        data = orjson.loads(await response.read())
                         
                         # Limit to top 100 for demo
                         all_data = data[:100]
@@ -79,14 +116,14 @@ class CoinPaprikaPipeline(BasePipeline):
                         
                         return all_data
             
-            except aiohttp.ClientError as e:
-                logger.error(f"HTTP error: {e}")
-                retry_count += 1
-                if retry_count < settings.ETL_MAX_RETRIES:
-                    delay = await self.calculate_backoff(retry_count)
-                    await asyncio.sleep(delay)
-                else:
-                    raise
+                except aiohttp.ClientError as e:
+                    logger.error(f"HTTP error: {e}")
+                    retry_count += 1
+                    if retry_count < settings.ETL_MAX_RETRIES:
+                        delay = await self.calculate_backoff(retry_count)
+                        await asyncio.sleep(delay)
+                    else:
+                        raise
         
         raise Exception(f"Failed to extract data after {settings.ETL_MAX_RETRIES} retries")
     
@@ -98,37 +135,30 @@ class CoinPaprikaPipeline(BasePipeline):
         if settings.SCHEMA_DRIFT_ENABLED and raw_data:
             await self.detect_schema_drift(raw_data[0])
         
-        normalized_records = []
+        # Per-batch constants, bound once rather than per record
+        now = datetime.now()
+        source = self.SOURCE_NAME
         
-        for item in raw_data:
-            try:
-                # Validate with Pydantic
-                validated = CoinPaprikaData(**item)
-                
-                # Extract USD quote
-                usd_quote = validated.quotes.get('USD', {})
-                
-                normalized = {
-                    "source": self.SOURCE_NAME,
-                    "symbol": validated.symbol,
-                    "name": validated.name,
-                    "price_usd": Decimal(str(usd_quote.get('price', 0))),
-                    "market_cap_usd": Decimal(str(usd_quote.get('market_cap', 0))),
-                    "volume_24h_usd": Decimal(str(usd_quote.get('volume_24h', 0))),
-                    "percent_change_24h": Decimal(str(usd_quote.get('percent_change_24h', 0))),
-                    "rank": validated.rank,
-                    "last_updated": datetime.now(),
-                    "raw_data": item
-                }
-                
-                normalized_records.append(normalized)
-                
-            except ValidationError as e:
-                logger.warning(f"Validation error for record: {e}")
-                continue
-            except Exception as e:
-                logger.error(f"Transform error: {e}")
-                continue
+        normalized_records = [
+            {
+                "source": source,
+                "symbol": validated.symbol,
+                "name": validated.name,
+                "price_usd": price or ZERO,
+                "market_cap_usd": market_cap or ZERO,
+                "volume_24h_usd": volume_24h or ZERO,
+                "percent_change_24h": percent_change_24h or ZERO,
+                "rank": validated.rank,
+                "last_updated": now,
+                # Serialized once here and handed to the DB as-is
+                "raw_bytes": orjson.dumps(item)
+            }
+            for validated, item in self.validate_records(_ADAPTER, raw_data)
+            # Single-element loop unpacks the USD quote fields once per record
+            for price, market_cap, volume_24h, percent_change_24h in (
+                _GET_USD_FIELDS(validated.quotes.get('USD', EMPTY_QUOTE)),
+            )
+        ]
         
         logger.info(f"Transformed {len(normalized_records)} valid records")
         return normalized_records
@@ -137,50 +167,27 @@ class CoinPaprikaPipeline(BasePipeline):
         """Load data into database with checkpointing"""
         logger.info(f"Loading {len(normalized_data)} records to database")
         
-        # Save raw data first
-        await self.db.save_raw_data(
-            source=self.SOURCE_NAME,
-            data=[r['raw_data'] for r in normalized_data],
-            source_ids=[r['symbol'] for r in normalized_data]
-        )
-        
-        # Batch load with checkpointing
-        batch_size = settings.CHECKPOINT_INTERVAL
-        total_loaded = 0
+        total_loaded = len(normalized_data)
         
-        for i in range(0, len(normalized_data), batch_size):
-            batch = normalized_data[i:i + batch_size]
+        # Raw, normalized and checkpoint writes share one connection and
+        # commit together
+        async with self.db.transaction() as tx:
+            # Save raw data first (one pass builds the payload/id pairs)
+            await tx.save_raw_data(
+                source=self.SOURCE_NAME,
+                rows=[(r['raw_bytes'], r['symbol']) for r in normalized_data]
+            )
             
-            try:
-                await self.db.save_normalized_data(batch)
-                total_loaded += len(batch)
-                
-                # Save checkpoint
-                if settings.CHECKPOINT_ENABLED:
-                    await self.db.save_checkpoint(
-                        source=self.SOURCE_NAME,
-                        checkpoint_data={"last_index": i + batch_size},
-                        records_processed=total_loaded
-                    )
-                
-                logger.info(f"Loaded batch: {total_loaded}/{len(normalized_data)} records")
-                
-            except Exception as e:
-                logger.error(f"Error loading batch: {e}")
-                raise
-        
-        # Mark checkpoint as completed
-        if settings.CHECKPOINT_ENABLED:
-            await self.db.mark_checkpoint_completed(self.SOURCE_NAME)
+            # Single COPY-backed write for the whole batch
+            await tx.save_normalized_data(normalized_data)
+            
+            # Record one final checkpoint for the completed load
+            if settings.CHECKPOINT_ENABLED:
+                await tx.save_checkpoint(
+                    source=self.SOURCE_NAME,
+                    checkpoint_data={"last_index": total_loaded},
+                    records_processed=total_loaded,
+                    completed=True
+                )
         
         logger.info(f"Successfully loaded {total_loaded} records")
-    
-    def get_expected_schema(self) -> Dict:
-        """Get expected schema for drift detection"""
-        return {
-            "id": str,
-            "name": str,
-            "symbol": str,
-            "rank": int,
-            "quotes": dict
-        }
\ No newline at end of file
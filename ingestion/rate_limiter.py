@@ -0,0 +1,42 @@
+"""
+Token-bucket rate limiter for API pipelines
+"""
+import asyncio
+import time
+
+class AsyncRateLimiter:
+    """
+    Token bucket allowing max_rate acquisitions per time_period seconds.
+    
+    The bucket starts full, so callers only wait once the budget is spent.
+    """
+    
+    def __init__(self, max_rate: float, time_period: float = 60):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._rate_per_sec = max_rate / time_period
+        self._tokens = float(max_rate)
+        self._last_refill = time.monotonic()
+    
+    def _refill(self):
+        """Credit tokens earned since the last acquisition"""
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._tokens = min(self.max_rate, self._tokens + elapsed * self._rate_per_sec)
+        self._last_refill = now
+    
+    async def acquire(self):
+        """Take one token, sleeping until it becomes available"""
+        self._refill()
+        # Reserve the token up front; a negative balance queues later callers
+        # behind this one without needing a lock
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self._rate_per_sec)
+    
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
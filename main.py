@@ -4,49 +4,74 @@ Kasparro Backend & ETL System - Main Application
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Query, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from typing import Optional, List
+import itertools
+import os
 import time
 import uuid
+import aiohttp
+import orjson
 
 from api.models import (
     DataResponse, 
     HealthResponse, 
     StatsResponse, 
-    RunsResponse,
-    MetricsResponse
+    RunsResponse
 )
-from services.database import DatabaseService, get_db
+from api.responses import ORJSONResponse
+from services.database import DatabaseService, db_service, get_db
+from services.http_client import create_http_session, get_http_session
 from services.etl_orchestrator import ETLOrchestrator
 from core.config import settings
-from core.logger import setup_logger
+from core.logger import configure_logging, setup_logger
 
+configure_logging()
 logger = setup_logger(__name__)
 
+# Request ids are a per-process prefix plus a counter: unique across workers
+# and restarts without reading the OS entropy pool on every request
+_REQUEST_ID_PREFIX = f"{uuid.uuid4().hex[:8]}-{os.getpid()}"
+_request_counter = itertools.count(1)
+
+def next_request_id() -> str:
+    """Return the next request id for this process"""
+    return f"{_REQUEST_ID_PREFIX}-{next(_request_counter)}"
+
+def elapsed_ms(start_ns: int) -> float:
+    """Milliseconds since a time.perf_counter_ns() reading, to 2 places"""
+    return round((time.perf_counter_ns() - start_ns) / 1e6, 2)
+
 # Lifespan context manager for startup/shutdown
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager"""
     logger.info("🚀 Starting Kasparro Backend & ETL System")
     
-    # Initialize database
-    db = DatabaseService()
+    # Initialize the shared database pool
+    db = db_service
     await db.initialize()
     
+    # One pooled HTTP session shared by all API pipelines
+    app.state.http_session = create_http_session()
+    
     # Run initial ETL if configured
     if settings.RUN_ETL_ON_STARTUP:
         logger.info("Running initial ETL on startup...")
-        orchestrator = ETLOrchestrator(db)
+        orchestrator = ETLOrchestrator(db, app.state.http_session)
         await orchestrator.run_full_etl()
     
     yield
     
     logger.info("Shutting down application")
+    await app.state.http_session.close()
+    await db.close()
 
 app = FastAPI(
     title="Kasparro Backend & ETL System",
     description="Production-grade ETL pipeline with cryptocurrency data ingestion",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -71,8 +96,8 @@ async def health_check(db: DatabaseService = Depends(get_db)):
     Health check endpoint
     Reports DB connectivity and ETL last-run status
     """
-    start_time = time.time()
-    request_id = str(uuid.uuid4())
+    start_time = time.perf_counter_ns()
+    request_id = next_request_id()
     
     try:
         # Check database connectivity
@@ -81,7 +106,7 @@ async def health_check(db: DatabaseService = Depends(get_db)):
         # Get ETL status
         etl_status = await db.get_etl_status()
         
-        latency_ms = round((time.time() - start_time) * 1000, 2)
+        latency_ms = elapsed_ms(start_time)
         
         return HealthResponse(
             status="healthy" if db_healthy else "unhealthy",
@@ -94,7 +119,7 @@ async def health_check(db: DatabaseService = Depends(get_db)):
         )
     except Exception as e:
         logger.error(f"Health check failed: {e}")
-        latency_ms = round((time.time() - start_time) * 1000, 2)
+        latency_ms = elapsed_ms(start_time)
         return HealthResponse(
             status="unhealthy",
             database_connected=False,
@@ -105,19 +130,21 @@ async def health_check(db: DatabaseService = Depends(get_db)):
 
 @app.get("/data", response_model=DataResponse)
 async def get_data(
-    page: int = Query(1, ge=1, description="Page number"),
+    page: int = Query(1, ge=1, description="Page number (ignored when cursor is set)"),
     page_size: int = Query(50, ge=1, le=1000, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
     source: Optional[str] = Query(None, description="Filter by source (coinpaprika, coingecko, csv)"),
     symbol: Optional[str] = Query(None, description="Filter by cryptocurrency symbol"),
     min_price: Optional[float] = Query(None, description="Minimum price filter"),
     max_price: Optional[float] = Query(None, description="Maximum price filter"),
+    raw: Optional[str] = Query(None, description='JSON object the raw record must contain, e.g. {"id":"btc-bitcoin"}; not available for csv'),
     db: DatabaseService = Depends(get_db)
 ):
     """
     Get cryptocurrency data with pagination and filtering
     """
-    start_time = time.time()
-    request_id = str(uuid.uuid4())
+    start_time = time.perf_counter_ns()
+    request_id = next_request_id()
     
     try:
         # Build filters
@@ -130,26 +157,41 @@ async def get_data(
             filters['min_price'] = min_price
         if max_price is not None:
             filters['max_price'] = max_price
+        if raw:
+            raw_filter = orjson.loads(raw)
+            if not isinstance(raw_filter, dict):
+                raise ValueError("raw filter must be a JSON object")
+            # CSV rows keep their payload in raw_csv only, so the filter
+            # could never match them
+            if source == "csv":
+                raise ValueError("raw filter is not supported for source=csv")
+            filters['raw'] = raw_filter
         
         # Get data from database
         result = await db.get_data(
-            page=page,
             page_size=page_size,
-            filters=filters
+            filters=filters,
+            cursor=cursor,
+            page=None if cursor else page
         )
         
-        latency_ms = round((time.time() - start_time) * 1000, 2)
+        latency_ms = elapsed_ms(start_time)
         
-        return DataResponse(
-            data=result['data'],
-            total_records=result['total'],
-            page=page,
-            page_size=page_size,
-            total_pages=result['total_pages'],
-            filters=filters,
-            request_id=request_id,
-            api_latency_ms=latency_ms
-        )
+        # Rows are already plain dicts; returning the response directly skips
+        # re-validating them against DataResponse (kept for the OpenAPI docs)
+        return ORJSONResponse({
+            "data": result['data'],
+            # The page number is ignored when paging by cursor
+            "page": None if cursor else page,
+            "page_size": page_size,
+            "next_cursor": result['next_cursor'],
+            "has_more": result['has_more'],
+            "filters": filters,
+            "request_id": request_id,
+            "api_latency_ms": latency_ms
+        })
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching data: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -159,12 +201,12 @@ async def get_stats(db: DatabaseService = Depends(get_db)):
     """
     Get ETL statistics and summaries
     """
-    start_time = time.time()
-    request_id = str(uuid.uuid4())
+    start_time = time.perf_counter_ns()
+    request_id = next_request_id()
     
     try:
         stats = await db.get_etl_stats()
-        latency_ms = round((time.time() - start_time) * 1000, 2)
+        latency_ms = elapsed_ms(start_time)
         
         return StatsResponse(
             total_records_processed=stats.get('total_records', 0),
@@ -190,72 +232,78 @@ async def get_runs(
     """
     Get recent ETL run history
     """
-    start_time = time.time()
-    request_id = str(uuid.uuid4())
+    start_time = time.perf_counter_ns()
+    request_id = next_request_id()
     
     try:
         runs = await db.get_recent_runs(limit=limit)
-        latency_ms = round((time.time() - start_time) * 1000, 2)
+        latency_ms = elapsed_ms(start_time)
         
-        return RunsResponse(
-            runs=runs,
-            count=len(runs),
-            request_id=request_id,
-            api_latency_ms=latency_ms
-        )
+        # Same as /data: skip response-model validation of the row dicts
+        return ORJSONResponse({
+            "runs": runs,
+            "count": len(runs),
+            "request_id": request_id,
+            "api_latency_ms": latency_ms
+        })
     except Exception as e:
         logger.error(f"Error fetching runs: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/metrics", response_model=MetricsResponse)
+# Prometheus text exposition format (Starlette appends "; charset=utf-8")
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# (name, help, type, stats key) for each scalar metric
+METRIC_DEFINITIONS = [
+    ("etl_total_records", "Total records processed", "gauge", "total_records"),
+    ("etl_total_runs", "Total ETL runs", "counter", "total_runs"),
+    ("etl_successful_runs", "Successful ETL runs", "counter", "successful_runs"),
+    ("etl_failed_runs", "Failed ETL runs", "counter", "failed_runs"),
+]
+
+# Static HELP/TYPE lines plus the sample prefix, encoded once at import
+METRIC_PREFIXES = [
+    (f"# HELP {name} {help_text}\n# TYPE {name} {metric_type}\n{name} ".encode(), key)
+    for name, help_text, metric_type, key in METRIC_DEFINITIONS
+]
+BY_SOURCE_HEADER = (
+    b"# HELP etl_records_by_source Records stored per source\n"
+    b"# TYPE etl_records_by_source gauge\n"
+)
+
+@app.get("/metrics", response_class=PlainTextResponse)
 async def get_metrics(db: DatabaseService = Depends(get_db)):
     """
     Get system metrics in Prometheus format
     """
-    start_time = time.time()
-    
     try:
         stats = await db.get_etl_stats()
         
-        # Generate Prometheus-style metrics
-        metrics = []
-        metrics.append(f"# HELP etl_total_records Total records processed")
-        metrics.append(f"# TYPE etl_total_records gauge")
-        metrics.append(f"etl_total_records {stats.get('total_records', 0)}")
-        
-        metrics.append(f"# HELP etl_total_runs Total ETL runs")
-        metrics.append(f"# TYPE etl_total_runs counter")
-        metrics.append(f"etl_total_runs {stats.get('total_runs', 0)}")
-        
-        metrics.append(f"# HELP etl_successful_runs Successful ETL runs")
-        metrics.append(f"# TYPE etl_successful_runs counter")
-        metrics.append(f"etl_successful_runs {stats.get('successful_runs', 0)}")
-        
-        metrics.append(f"# HELP etl_failed_runs Failed ETL runs")
-        metrics.append(f"# TYPE etl_failed_runs counter")
-        metrics.append(f"etl_failed_runs {stats.get('failed_runs', 0)}")
+        # Generate Prometheus text straight into a byte buffer
+        buf = bytearray()
+        for prefix, key in METRIC_PREFIXES:
+            buf += prefix
+            buf += b"%d\n" % (stats.get(key) or 0)
         
+        buf += BY_SOURCE_HEADER
         for source, count in stats.get('by_source', {}).items():
-            metrics.append(f'etl_records_by_source{{source="{source}"}} {count}')
-        
-        latency_ms = round((time.time() - start_time) * 1000, 2)
+            buf += b'etl_records_by_source{source="%s"} %d\n' % (source.encode(), count)
         
-        return MetricsResponse(
-            metrics="\n".join(metrics),
-            timestamp=time.time(),
-            api_latency_ms=latency_ms
-        )
+        return Response(content=bytes(buf), media_type=PROMETHEUS_CONTENT_TYPE)
     except Exception as e:
         logger.error(f"Error generating metrics: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/trigger-etl")
-async def trigger_etl(db: DatabaseService = Depends(get_db)):
+async def trigger_etl(
+    db: DatabaseService = Depends(get_db),
+    http_session: Optional[aiohttp.ClientSession] = Depends(get_http_session)
+):
     """
     Manually trigger ETL process (useful for testing)
     """
     try:
-        orchestrator = ETLOrchestrator(db)
+        orchestrator = ETLOrchestrator(db, http_session)
         result = await orchestrator.run_full_etl()
         return {"status": "completed", "result": result}
     except Exception as e:
@@ -264,9 +312,27 @@ async def trigger_etl(db: DatabaseService = Depends(get_db)):
 
 if __name__ == "__main__":
     import uvicorn
+    
+    # uvloop and httptools ship with uvicorn[standard]; fall back to the
+    # pure-Python loop/parser if they aren't installed
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        http = "h11"
+    
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=settings.DEBUG
+        loop=loop,
+        http=http,
+        # Auto-reload is a development aid and can't be combined with workers
+        reload=settings.DEBUG,
+        workers=1 if settings.DEBUG else settings.API_WORKERS
     )
\ No newline at end of file
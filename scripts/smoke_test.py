@@ -17,6 +17,9 @@ from typing import Dict, Any
 
 BASE_URL = "http://localhost:8000"
 
+# One keep-alive connection reused by every check
+session = requests.Session()
+
 class Colors:
     GREEN = '\033[92m'
     RED = '\033[91m'
@@ -43,7 +46,7 @@ def check_health() -> bool:
     print_step("Test 1: Health Check")
     
     try:
-        response = requests.get(f"{BASE_URL}/health", timeout=10)
+        response = session.get(f"{BASE_URL}/health", timeout=10)
         response.raise_for_status()
         
         data = response.json()
@@ -72,7 +75,7 @@ def trigger_etl() -> bool:
     
     try:
         print("Triggering ETL (this may take 30-60 seconds)...")
-        response = requests.post(f"{BASE_URL}/trigger-etl", timeout=120)
+        response = session.post(f"{BASE_URL}/trigger-etl", timeout=120)
         response.raise_for_status()
         
         data = response.json()
@@ -93,7 +96,7 @@ def verify_data_ingestion() -> bool:
     print_step("Test 3: Verify Data Ingestion")
     
     try:
-        response = requests.get(f"{BASE_URL}/stats", timeout=10)
+        response = session.get(f"{BASE_URL}/stats", timeout=10)
         response.raise_for_status()
         
         data = response.json()
@@ -129,7 +132,7 @@ def test_api_endpoints() -> bool:
     
     # Test /data endpoint
     try:
-        response = requests.get(f"{BASE_URL}/data?page=1&page_size=5", timeout=10)
+        response = session.get(f"{BASE_URL}/data?page=1&page_size=5", timeout=10)
         response.raise_for_status()
         data = response.json()
         
@@ -149,7 +152,7 @@ def test_api_endpoints() -> bool:
     
     # Test /data with filters
     try:
-        response = requests.get(
+        response = session.get(
             f"{BASE_URL}/data?source=coinpaprika&page_size=3",
             timeout=10
         )
@@ -163,7 +166,7 @@ def test_api_endpoints() -> bool:
     
     # Test /runs endpoint
     try:
-        response = requests.get(f"{BASE_URL}/runs?limit=3", timeout=10)
+        response = session.get(f"{BASE_URL}/runs?limit=3", timeout=10)
         response.raise_for_status()
         data = response.json()
         print_success(f"GET /runs: Retrieved {data.get('count', 0)} recent runs")
@@ -179,21 +182,19 @@ def test_metrics() -> bool:
     print_step("Test 5: Check Metrics")
     
     try:
-        response = requests.get(f"{BASE_URL}/metrics", timeout=10)
+        response = session.get(f"{BASE_URL}/metrics", timeout=10)
         response.raise_for_status()
         
-        data = response.json()
-        metrics = data.get("metrics", "")
+        # Plain Prometheus text, not JSON
+        metrics = response.text
         
         if "etl_total_records" in metrics:
             print_success("Metrics endpoint working")
             
-            # Parse some metrics
-            for line in metrics.split('\n'):
-                if line and not line.startswith('#'):
-                    print(f"   {line}")
-                    if len([l for l in metrics.split('\n') if l and not l.startswith('#')]) > 5:
-                        break
+            # Show the first few samples (split and filtered once)
+            data_lines = [l for l in metrics.split('\n') if l and not l.startswith('#')]
+            for line in data_lines[:6]:
+                print(f"   {line}")
             
             return True
         else:
@@ -210,7 +211,7 @@ def test_etl_recovery() -> bool:
     
     try:
         # Check that checkpoints are being created
-        response = requests.get(f"{BASE_URL}/stats", timeout=10)
+        response = session.get(f"{BASE_URL}/stats", timeout=10)
         response.raise_for_status()
         
         print_success("ETL checkpoint system is enabled")
@@ -236,7 +237,7 @@ def run_smoke_test():
     max_retries = 10
     for i in range(max_retries):
         try:
-            requests.get(f"{BASE_URL}/health", timeout=5)
+            session.get(f"{BASE_URL}/health", timeout=5)
             print_success("Service is ready!")
             break
         except:
@@ -2,28 +2,159 @@
 Database service for managing PostgreSQL operations
 """
 import asyncpg
-from typing import Dict, List, Optional, Any
-from datetime import datetime
-import json
+import copy
+import base64
+from typing import Dict, List, Optional, Any, AsyncIterator, Tuple
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime, timedelta
+from functools import lru_cache
+import orjson
+from core.cache import async_ttl_cache
 from core.config import settings
 from core.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Columns written to crypto_data by the ETL load step
+NORMALIZED_COLUMNS = [
+    'source', 'symbol', 'name', 'price_usd', 'market_cap_usd', 'volume_24h_usd',
+    'percent_change_24h', 'rank', 'last_updated', 'raw_data'
+]
+NORMALIZED_COLUMNS_SQL = ", ".join(NORMALIZED_COLUMNS)
+
+# Amounts that can't be negative; CHECKed in crypto_data
+NON_NEGATIVE_COLUMNS = ('price_usd', 'market_cap_usd', 'volume_24h_usd')
+
+# Batches smaller than this skip the COPY staging table (its per-call DDL
+# costs more than it saves) and go through one multi-row INSERT instead
+NORMALIZED_COPY_MIN_ROWS = 500
+
+# One array parameter per column; asyncpg prepares and caches this once
+NORMALIZED_UNNEST_INSERT = f"""
+    INSERT INTO crypto_data ({NORMALIZED_COLUMNS_SQL})
+    SELECT * FROM unnest(
+        $1::varchar[], $2::varchar[], $3::varchar[], $4::float8[], $5::float8[],
+        $6::float8[], $7::float8[], $8::integer[], $9::timestamp[], $10::jsonb[]
+    )
+    ON CONFLICT (source, symbol, last_updated) DO NOTHING
+"""
+
+def encode_cursor(row: Dict) -> str:
+    """Opaque keyset cursor pointing just past the given row"""
+    token = f"{row['last_updated'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(token.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor; raises ValueError if the cursor is malformed"""
+    try:
+        ts, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(ts), int(row_id)
+    except ValueError as e:  # covers binascii.Error and UnicodeDecodeError
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+# Derived by the database when a run's end_time is set
+RUN_DURATION_COLUMN = (
+    "DOUBLE PRECISION GENERATED ALWAYS AS (EXTRACT(EPOCH FROM (end_time - start_time))) STORED"
+)
+
+# Per-source raw payload archives
+RAW_TABLES = ('raw_coinpaprika', 'raw_coingecko', 'raw_csv')
+
+# get_data filter name -> predicate; placeholders are numbered in this order
+DATA_FILTER_CLAUSES = {
+    'source': "source = ${}",
+    'symbol': "symbol = ${}",
+    'min_price': "price_usd >= ${}",
+    'max_price': "price_usd <= ${}",
+    'raw': "raw_data @> ${}::jsonb",
+}
+
+@lru_cache(maxsize=None)
+def _data_query(filter_names: Tuple[str, ...], keyset: bool) -> str:
+    """
+    Build the get_data SQL for one filter shape.
+    
+    Identical text per shape means asyncpg's per-connection statement cache
+    reuses the server-side prepared statement instead of re-planning.
+    """
+    where_clauses = [
+        DATA_FILTER_CLAUSES[name].format(num)
+        for num, name in enumerate(filter_names, start=1)
+    ]
+    param_num = len(filter_names) + 1
+    if keyset:
+        where_clauses.append(f"(last_updated, id) < (${param_num}, ${param_num + 1})")
+        param_num += 2
+        paging_sql = f"LIMIT ${param_num}"
+    else:
+        paging_sql = f"LIMIT ${param_num} OFFSET ${param_num + 1}"
+    where_sql = "WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+    return f"""
+        SELECT 
+            id, source, symbol, name, price_usd, market_cap_usd,
+            volume_24h_usd, percent_change_24h, rank, last_updated, ingested_at
+        FROM crypto_data
+        {where_sql}
+        ORDER BY last_updated DESC, id DESC
+        {paging_sql}
+    """
+
+def _encode_jsonb(value: Any) -> bytes:
+    """Binary jsonb encoder; pre-serialized documents (bytes) pass through as-is"""
+    if not isinstance(value, (bytes, bytearray)):
+        value = orjson.dumps(value)
+    return b'\x01' + value
+
+def _decode_jsonb(data: bytes) -> Any:
+    """Binary jsonb decoder (skips the format version byte)"""
+    return orjson.loads(data[1:])
+
+async def _init_connection(conn: asyncpg.Connection):
+    """Exchange jsonb with the server in binary form, encoded with orjson"""
+    await conn.set_type_codec(
+        'jsonb', schema='pg_catalog', format='binary',
+        encoder=_encode_jsonb, decoder=_decode_jsonb
+    )
+
 class DatabaseService:
     """Database service for PostgreSQL operations"""
     
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
+        # Set on the bound copies handed out by transaction()
+        self._conn: Optional[asyncpg.Connection] = None
+    
+    def _acquire(self):
+        """Connection for one operation: the bound one, else one from the pool"""
+        if self._conn is not None:
+            return nullcontext(self._conn)
+        return self.pool.acquire()
+    
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator["DatabaseService"]:
+        """
+        Hold one connection and transaction across several calls.
+        
+        Yields a copy of this service whose methods all run on that
+        connection, so a pipeline's load step acquires once and commits or
+        rolls back as a unit.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                bound = copy.copy(self)
+                bound._conn = conn
+                yield bound
     
     async def initialize(self):
         """Initialize database connection pool and create tables"""
         try:
             self.pool = await asyncpg.create_pool(
                 settings.DATABASE_URL,
-                min_size=2,
-                max_size=10,
-                command_timeout=60
+                min_size=settings.DB_POOL_MIN_SIZE,
+                max_size=settings.DB_POOL_MAX_SIZE,
+                statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE,
+                command_timeout=60,
+                init=_init_connection
             )
             logger.info("Database pool created successfully")
             await self.create_tables()
@@ -33,34 +164,24 @@ class DatabaseService:
     
     async def create_tables(self):
         """Create all required database tables"""
-        async with self.pool.acquire() as conn:
-            # Raw data tables
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS raw_coinpaprika (
-                    id SERIAL PRIMARY KEY,
-                    data JSONB NOT NULL,
-                    ingested_at TIMESTAMP DEFAULT NOW(),
-                    source_id VARCHAR(255)
-                )
-            """)
-            
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS raw_coingecko (
-                    id SERIAL PRIMARY KEY,
-                    data JSONB NOT NULL,
-                    ingested_at TIMESTAMP DEFAULT NOW(),
-                    source_id VARCHAR(255)
-                )
-            """)
-            
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS raw_csv (
-                    id SERIAL PRIMARY KEY,
-                    data JSONB NOT NULL,
-                    ingested_at TIMESTAMP DEFAULT NOW(),
-                    source_id VARCHAR(255)
-                )
-            """)
+        async with self._acquire() as conn:
+            # Raw data tables: write-mostly archives, range-partitioned by
+            # month so retention is a DROP of old partitions, not a DELETE.
+            # Partitions are UNLOGGED: inserts skip the WAL, at the cost of
+            # the raw payloads being truncated after a crash - acceptable as
+            # they can be re-fetched and crypto_data (logged) holds the
+            # normalized copy
+            for table in RAW_TABLES:
+                await conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        id SERIAL,
+                        data JSONB NOT NULL,
+                        ingested_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                        source_id VARCHAR(255),
+                        PRIMARY KEY (id, ingested_at)
+                    ) PARTITION BY RANGE (ingested_at)
+                """)
+                await self._ensure_raw_partitions(conn, table)
             
             # Unified normalized table
             await conn.execute("""
@@ -69,28 +190,46 @@ class DatabaseService:
                     source VARCHAR(50) NOT NULL,
                     symbol VARCHAR(50) NOT NULL,
                     name VARCHAR(255),
-                    price_usd DECIMAL(20, 8),
-                    market_cap_usd DECIMAL(20, 2),
-                    volume_24h_usd DECIMAL(20, 2),
-                    percent_change_24h DECIMAL(10, 4),
+                    price_usd DOUBLE PRECISION CHECK (price_usd >= 0),
+                    market_cap_usd DOUBLE PRECISION CHECK (market_cap_usd >= 0),
+                    volume_24h_usd DOUBLE PRECISION CHECK (volume_24h_usd >= 0),
+                    percent_change_24h DOUBLE PRECISION,
                     rank INTEGER,
-                    last_updated TIMESTAMP,
+                    last_updated TIMESTAMP NOT NULL,
                     ingested_at TIMESTAMP DEFAULT NOW(),
                     raw_data JSONB,
                     UNIQUE(source, symbol, last_updated)
                 )
             """)
+            await self._upgrade_crypto_data(conn)
             
             # Create indexes
             await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_crypto_source ON crypto_data(source)
+                CREATE INDEX IF NOT EXISTS idx_crypto_symbol ON crypto_data(symbol)
             """)
+            # Serves keyset pagination in get_data
             await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_crypto_symbol ON crypto_data(symbol)
+                CREATE INDEX IF NOT EXISTS idx_crypto_keyset ON crypto_data(last_updated DESC, id DESC)
             """)
+            # Source (+ symbol) filters with the get_data ordering straight from the index
             await conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_crypto_updated ON crypto_data(last_updated)
+                CREATE INDEX IF NOT EXISTS idx_crypto_source_symbol_updated
+                ON crypto_data(source, symbol, last_updated DESC, id DESC)
             """)
+            # Covered by the two indexes above
+            await conn.execute("DROP INDEX IF EXISTS idx_crypto_source")
+            await conn.execute("DROP INDEX IF EXISTS idx_crypto_updated")
+            # jsonb_path_ops GIN indexes only accelerate containment (@>)
+            for table, column in (
+                ("raw_coinpaprika", "data"),
+                ("raw_coingecko", "data"),
+                ("raw_csv", "data"),
+                ("crypto_data", "raw_data"),
+            ):
+                await conn.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_{table}_{column}_gin
+                    ON {table} USING gin({column} jsonb_path_ops)
+                """)
             
             # ETL checkpoint table
             await conn.execute("""
@@ -103,21 +242,47 @@ class DatabaseService:
                     completed BOOLEAN DEFAULT FALSE
                 )
             """)
+            # Matches get_last_checkpoint; completed checkpoints are never read
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_etl_checkpoints_source_created
+                ON etl_checkpoints(source, created_at DESC) WHERE NOT completed
+            """)
             
             # ETL runs metadata table
-            await conn.execute("""
+            await conn.execute(f"""
                 CREATE TABLE IF NOT EXISTS etl_runs (
                     id SERIAL PRIMARY KEY,
                     source VARCHAR(50) NOT NULL,
                     status VARCHAR(50) NOT NULL,
                     records_processed INTEGER DEFAULT 0,
-                    start_time TIMESTAMP NOT NULL,
-                    end_time TIMESTAMP,
-                    duration_seconds DECIMAL(10, 2),
+                    start_time TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp(),
+                    end_time TIMESTAMPTZ,
+                    duration_seconds {RUN_DURATION_COLUMN},
                     error_message TEXT,
                     metadata JSONB
                 )
             """)
+            await self._upgrade_etl_runs(conn)
+            # Latest run overall / latest run per status, without a sort
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_etl_runs_start_time ON etl_runs(start_time DESC)
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_etl_runs_status_starttime ON etl_runs(status, start_time DESC)
+            """)
+            
+            # Per-source row counts for /stats and /metrics, refreshed after
+            # ETL runs instead of aggregating crypto_data on every read
+            await conn.execute("""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS mv_crypto_by_source AS
+                SELECT source, COUNT(*) AS count
+                FROM crypto_data
+                GROUP BY source
+            """)
+            # Required for REFRESH ... CONCURRENTLY
+            await conn.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_crypto_by_source ON mv_crypto_by_source(source)
+            """)
             
             # Schema drift logs
             await conn.execute("""
@@ -134,10 +299,157 @@ class DatabaseService:
             
             logger.info("All database tables created successfully")
     
+    async def _upgrade_crypto_data(self, conn: asyncpg.Connection):
+        """Bring a crypto_data table created by an older release up to the current column types"""
+        numeric_columns = [
+            row['column_name'] for row in await conn.fetch("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = 'crypto_data'
+                  AND data_type = 'numeric'
+            """)
+        ]
+        if numeric_columns:
+            logger.info(f"Converting crypto_data columns {numeric_columns} to DOUBLE PRECISION")
+            await conn.execute("ALTER TABLE crypto_data " + ", ".join(
+                f"ALTER COLUMN {column} TYPE DOUBLE PRECISION" for column in numeric_columns
+            ))
+        
+        # Keyset cursors need a timestamp on every row; rows saved without
+        # one fall back to when they were ingested
+        if await conn.fetchval("""
+            SELECT is_nullable = 'YES' FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'crypto_data'
+              AND column_name = 'last_updated'
+        """):
+            logger.info("Making crypto_data.last_updated NOT NULL")
+            async with conn.transaction():
+                await conn.execute("""
+                    UPDATE crypto_data SET last_updated = COALESCE(ingested_at, NOW())
+                    WHERE last_updated IS NULL
+                """)
+                await conn.execute("ALTER TABLE crypto_data ALTER COLUMN last_updated SET NOT NULL")
+        
+        # Same names Postgres gives the inline CHECKs on a fresh table. NOT
+        # VALID: new rows are checked without failing on legacy negatives
+        constraints = {
+            row['conname'] for row in await conn.fetch(
+                "SELECT conname FROM pg_constraint WHERE conrelid = 'crypto_data'::regclass"
+            )
+        }
+        for column in NON_NEGATIVE_COLUMNS:
+            name = f"crypto_data_{column}_check"
+            if name not in constraints:
+                await conn.execute(
+                    f"ALTER TABLE crypto_data ADD CONSTRAINT {name} CHECK ({column} >= 0) NOT VALID"
+                )
+    
+    async def _upgrade_etl_runs(self, conn: asyncpg.Connection):
+        """Bring an etl_runs table created by an older release up to the current definition"""
+        columns = {
+            row['column_name']: row for row in await conn.fetch("""
+                SELECT column_name, data_type, is_generated FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = 'etl_runs'
+            """)
+        }
+        duration = columns['duration_seconds']
+        rebuild_duration = (
+            duration['data_type'] != 'double precision' or duration['is_generated'] != 'ALWAYS'
+        )
+        naive_columns = [
+            column for column in ('start_time', 'end_time')
+            if columns[column]['data_type'] == 'timestamp without time zone'
+        ]
+        
+        async with conn.transaction():
+            # Runs were stamped server-side from clock_timestamp()
+            await conn.execute("ALTER TABLE etl_runs ALTER COLUMN start_time SET DEFAULT clock_timestamp()")
+            if not (rebuild_duration or naive_columns):
+                return
+            
+            logger.info("Upgrading etl_runs timestamps and run duration")
+            # Dropped first: a generated column pins the types of its inputs.
+            # Re-adding it recomputes the duration of every existing run
+            if rebuild_duration:
+                await conn.execute("ALTER TABLE etl_runs DROP COLUMN duration_seconds")
+            for column in naive_columns:
+                # Legacy values were written in the server's local time
+                await conn.execute(f"ALTER TABLE etl_runs ALTER COLUMN {column} TYPE TIMESTAMPTZ")
+            if rebuild_duration:
+                await conn.execute(
+                    f"ALTER TABLE etl_runs ADD COLUMN duration_seconds {RUN_DURATION_COLUMN}"
+                )
+    
+    async def _ensure_raw_partitions(self, conn: asyncpg.Connection, table: str):
+        """Create this month's and the next few months' partitions of a raw table"""
+        relkind = await conn.fetchval(
+            "SELECT relkind::text FROM pg_class WHERE oid = $1::regclass", table
+        )
+        if relkind != 'p':
+            # Created before raw tables were partitioned; left as is
+            logger.info(f"{table} is not partitioned, skipping partition setup")
+            return
+        
+        month = datetime.now().date().replace(day=1)
+        for _ in range(settings.RAW_PARTITION_MONTHS_AHEAD + 1):
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            await self._create_raw_partition(conn, table, month, next_month)
+            month = next_month
+        # Catches rows outside the pre-created months
+        await conn.execute(f"""
+            CREATE UNLOGGED TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT
+        """)
+        
+        # Payloads are rarely read back, so trade a little CPU for smaller
+        # TOAST storage; recurses into every partition
+        try:
+            await conn.execute(f"ALTER TABLE {table} ALTER COLUMN data SET COMPRESSION lz4")
+        except asyncpg.FeatureNotSupportedError:
+            logger.info(f"Postgres built without lz4; {table} keeps the default compression")
+    
+    async def _create_raw_partition(self, conn: asyncpg.Connection, table: str, month, next_month):
+        """
+        Create one month's partition of a raw table if it's missing.
+        
+        If the service ran past the pre-created months, that month's rows
+        sit in the DEFAULT partition and Postgres refuses to create the new
+        partition over them. The default is detached, the rows are moved
+        into the new partition and the default is attached again, all in
+        one transaction.
+        """
+        partition = f"{table}_{month:%Y_%m}"
+        if await conn.fetchval("SELECT to_regclass($1)", partition) is not None:
+            return
+        
+        in_range = f"ingested_at >= '{month}' AND ingested_at < '{next_month}'"
+        async with conn.transaction():
+            has_default = await conn.fetchval("SELECT to_regclass($1)", f"{table}_default") is not None
+            stranded = has_default and await conn.fetchval(
+                f"SELECT EXISTS (SELECT 1 FROM {table}_default WHERE {in_range})"
+            )
+            if stranded:
+                await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {table}_default")
+            
+            await conn.execute(f"""
+                CREATE UNLOGGED TABLE {partition}
+                PARTITION OF {table} FOR VALUES FROM ('{month}') TO ('{next_month}')
+            """)
+            
+            if stranded:
+                moved = await conn.execute(f"""
+                    WITH moved AS (
+                        DELETE FROM {table}_default WHERE {in_range}
+                        RETURNING id, data, ingested_at, source_id
+                    )
+                    INSERT INTO {table} (id, data, ingested_at, source_id)
+                    SELECT id, data, ingested_at, source_id FROM moved
+                """)
+                await conn.execute(f"ALTER TABLE {table} ATTACH PARTITION {table}_default DEFAULT")
+                logger.info(f"Moved {moved.split()[-1]} rows from {table}_default into {partition}")
+    
     async def check_health(self) -> bool:
         """Check database connectivity"""
         try:
-            async with self.pool.acquire() as conn:
+            async with self._acquire() as conn:
                 await conn.fetchval("SELECT 1")
             return True
         except Exception as e:
@@ -147,7 +459,7 @@ class DatabaseService:
     async def get_etl_status(self) -> Dict[str, Any]:
         """Get ETL last run status"""
         try:
-            async with self.pool.acquire() as conn:
+            async with self._acquire() as conn:
                 last_run = await conn.fetchrow("""
                     SELECT status, end_time, source, records_processed
                     FROM etl_runs
@@ -172,125 +484,105 @@ class DatabaseService:
             logger.error(f"Error getting ETL status: {e}")
             return {"status": "error", "last_run": None, "last_success": None}
     
-    async def get_data(self, page: int, page_size: int, filters: Dict) -> Dict:
-        """Get paginated and filtered data"""
-        offset = (page - 1) * page_size
-        
-        # Build WHERE clause
-        where_clauses = []
-        params = []
-        param_num = 1
-        
-        if 'source' in filters:
-            where_clauses.append(f"source = ${param_num}")
-            params.append(filters['source'])
-            param_num += 1
+    async def get_data(self, page_size: int, filters: Dict, cursor: Optional[str] = None,
+                       page: Optional[int] = None) -> Dict:
+        """
+        Get paginated and filtered data, newest first.
         
-        if 'symbol' in filters:
-            where_clauses.append(f"symbol = ${param_num}")
-            params.append(filters['symbol'])
-            param_num += 1
+        Pages are addressed by an opaque keyset cursor (from next_cursor of
+        the previous page), so deep pages cost the same as the first one.
+        The OFFSET-based page number is still accepted when no cursor is
+        given. Raises ValueError for a malformed cursor.
         
-        if 'min_price' in filters:
-            where_clauses.append(f"price_usd >= ${param_num}")
-            params.append(filters['min_price'])
-            param_num += 1
+        filters['raw'] is matched against raw_data with @> containment, the
+        only JSONB operator the jsonb_path_ops GIN index can serve; don't
+        rewrite it as raw_data->>'key' = value.
+        """
+        # Filter values in clause order; the SQL text depends only on which
+        # filters are present
+        filter_names = tuple(name for name in DATA_FILTER_CLAUSES if name in filters)
+        params = [
+            filters[name] for name in filter_names
+        ]
         
-        if 'max_price' in filters:
-            where_clauses.append(f"price_usd <= ${param_num}")
-            params.append(filters['max_price'])
-            param_num += 1
+        if cursor is not None:
+            # Range-scan idx_crypto_keyset from the last row already returned
+            params.extend(decode_cursor(cursor))
         
-        where_sql = "WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+        # Fetch one extra row to learn whether another page exists,
+        # instead of counting every matching row
+        params.append(page_size + 1)
+        if cursor is None:
+            params.append(((page or 1) - 1) * page_size)
         
-        async with self.pool.acquire() as conn:
-            # Get total count
-            count_query = f"SELECT COUNT(*) FROM crypto_data {where_sql}"
-            total = await conn.fetchval(count_query, *params)
-            
-            # Get paginated data
-            data_query = f"""
-                SELECT 
-                    id, source, symbol, name, price_usd, market_cap_usd,
-                    volume_24h_usd, percent_change_24h, rank, last_updated, ingested_at
-                FROM crypto_data
-                {where_sql}
-                ORDER BY last_updated DESC
-                LIMIT ${param_num} OFFSET ${param_num + 1}
-            """
-            params.extend([page_size, offset])
-            
-            rows = await conn.fetch(data_query, *params)
+        async with self._acquire() as conn:
+            rows = await conn.fetch(_data_query(filter_names, cursor is not None), *params)
             
-            data = [dict(row) for row in rows]
+            has_more = len(rows) > page_size
+            data = [dict(row) for row in rows[:page_size]]
             
             return {
                 "data": data,
-                "total": total,
-                "total_pages": (total + page_size - 1) // page_size
+                "has_more": has_more,
+                "next_cursor": encode_cursor(data[-1]) if has_more else None
             }
     
+    @async_ttl_cache(settings.STATS_CACHE_TTL)
     async def get_etl_stats(self) -> Dict:
-        """Get comprehensive ETL statistics"""
-        async with self.pool.acquire() as conn:
-            # Total records
-            total_records = await conn.fetchval("SELECT COUNT(*) FROM crypto_data")
-            
-            # Records by source
-            by_source = await conn.fetch("""
-                SELECT source, COUNT(*) as count
-                FROM crypto_data
-                GROUP BY source
-            """)
-            by_source_dict = {row['source']: row['count'] for row in by_source}
-            
-            # Run statistics
-            runs = await conn.fetchrow("""
-                SELECT 
-                    COUNT(*) as total_runs,
-                    SUM(CASE WHEN status = 'success' THEN 1 ELSE 0 END) as successful_runs,
-                    SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed_runs
-                FROM etl_runs
-            """)
-            
-            # Last run duration
-            last_run = await conn.fetchrow("""
-                SELECT duration_seconds, end_time
-                FROM etl_runs
-                WHERE status = 'success'
-                ORDER BY start_time DESC
-                LIMIT 1
-            """)
-            
-            # Last success/failure timestamps
-            last_success = await conn.fetchval("""
-                SELECT end_time FROM etl_runs
-                WHERE status = 'success'
-                ORDER BY start_time DESC
-                LIMIT 1
-            """)
-            
-            last_failure = await conn.fetchval("""
-                SELECT end_time FROM etl_runs
-                WHERE status = 'failed'
-                ORDER BY start_time DESC
-                LIMIT 1
+        """Get comprehensive ETL statistics (one round trip, cached until the next run finishes)"""
+        async with self._acquire() as conn:
+            row = await conn.fetchrow("""
+                WITH by_source AS (
+                    SELECT source, count FROM mv_crypto_by_source
+                ), runs AS (
+                    SELECT
+                        COUNT(*) AS total_runs,
+                        COUNT(*) FILTER (WHERE status = 'success') AS successful_runs,
+                        COUNT(*) FILTER (WHERE status = 'failed') AS failed_runs
+                    FROM etl_runs
+                )
+                SELECT
+                    (SELECT COALESCE(SUM(count), 0) FROM by_source)::bigint AS total_records,
+                    (SELECT COALESCE(jsonb_object_agg(source, count), '{}'::jsonb) FROM by_source) AS by_source,
+                    runs.*,
+                    last_success.duration_seconds AS last_duration,
+                    last_success.end_time AS last_success,
+                    (
+                        SELECT end_time FROM etl_runs
+                        WHERE status = 'failed'
+                        ORDER BY start_time DESC
+                        LIMIT 1
+                    ) AS last_failure
+                FROM runs
+                LEFT JOIN LATERAL (
+                    SELECT duration_seconds, end_time FROM etl_runs
+                    WHERE status = 'success'
+                    ORDER BY start_time DESC
+                    LIMIT 1
+                ) last_success ON TRUE
             """)
             
             return {
-                "total_records": total_records,
-                "by_source": by_source_dict,
-                "last_duration": float(last_run['duration_seconds']) if last_run and last_run['duration_seconds'] else 0,
-                "last_success": last_success.isoformat() if last_success else None,
-                "last_failure": last_failure.isoformat() if last_failure else None,
-                "total_runs": runs['total_runs'] or 0,
-                "successful_runs": runs['successful_runs'] or 0,
-                "failed_runs": runs['failed_runs'] or 0
+                "total_records": row['total_records'],
+                "by_source": row['by_source'],
+                "last_duration": row['last_duration'] or 0,
+                "last_success": row['last_success'].isoformat() if row['last_success'] else None,
+                "last_failure": row['last_failure'].isoformat() if row['last_failure'] else None,
+                "total_runs": row['total_runs'],
+                "successful_runs": row['successful_runs'],
+                "failed_runs": row['failed_runs']
             }
     
+    async def refresh_stats(self):
+        """Recount records per source after ETL; readers keep the old counts meanwhile"""
+        async with self._acquire() as conn:
+            await conn.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY mv_crypto_by_source")
+        DatabaseService.get_etl_stats.cache_clear()
+    
+    @async_ttl_cache(settings.RUNS_CACHE_TTL)
     async def get_recent_runs(self, limit: int = 10) -> List[Dict]:
         """Get recent ETL runs"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             rows = await conn.fetch("""
                 SELECT 
                     id, source, status, records_processed, 
@@ -302,8 +594,12 @@ class DatabaseService:
             
             return [dict(row) for row in rows]
     
-    async def save_raw_data(self, source: str, data: List[Dict], source_ids: List[str] = None):
-        """Save raw data to appropriate table"""
+    async def save_raw_data(self, source: str, rows: List[Tuple[bytes, Optional[str]]]):
+        """
+        Save raw data to appropriate table.
+        
+        Rows are (serialized JSON document, source id) pairs.
+        """
         table_map = {
             "coinpaprika": "raw_coinpaprika",
             "coingecko": "raw_coingecko",
@@ -314,43 +610,87 @@ class DatabaseService:
         if not table:
             raise ValueError(f"Unknown source: {source}")
         
-        async with self.pool.acquire() as conn:
-            for idx, item in enumerate(data):
-                source_id = source_ids[idx] if source_ids and idx < len(source_ids) else None
-                await conn.execute(
-                    f"INSERT INTO {table} (data, source_id) VALUES ($1, $2)",
-                    json.dumps(item), source_id
-                )
+        if not rows:
+            return
+        
+        # Raw tables have no unique constraint, so COPY straight in; the
+        # pre-serialized payloads go out through the jsonb codec untouched
+        async with self._acquire() as conn:
+            await conn.copy_records_to_table(
+                table, records=rows, columns=['data', 'source_id']
+            )
     
-    async def save_normalized_data(self, records: List[Dict]):
-        """Save normalized data with idempotent writes"""
-        async with self.pool.acquire() as conn:
-            for record in records:
-                await conn.execute("""
-                    INSERT INTO crypto_data 
-                    (source, symbol, name, price_usd, market_cap_usd, volume_24h_usd,
-                     percent_change_24h, rank, last_updated, raw_data)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-                    ON CONFLICT (source, symbol, last_updated) DO NOTHING
-                """, 
-                    record['source'], record['symbol'], record.get('name'),
-                    record.get('price_usd'), record.get('market_cap_usd'),
-                    record.get('volume_24h_usd'), record.get('percent_change_24h'),
-                    record.get('rank'), record.get('last_updated'),
-                    json.dumps(record.get('raw_data', {}))
+    async def save_normalized_data(self, records: List[Dict], include_raw: bool = True):
+        """
+        Save normalized data with idempotent writes.
+        
+        With include_raw=False the raw_data column is left NULL, for sources
+        whose payload is already kept in their raw table. Small batches are
+        written with a single multi-row INSERT built from per-column arrays.
+        Larger ones are COPY'd into a temporary staging table and merged
+        with one INSERT ... ON CONFLICT DO NOTHING.
+        """
+        if not records:
+            return
+        
+        rows = [
+            (
+                record['source'], record['symbol'], record.get('name'),
+                record.get('price_usd'), record.get('market_cap_usd'),
+                record.get('volume_24h_usd'), record.get('percent_change_24h'),
+                record.get('rank'), record.get('last_updated'),
+                record.get('raw_bytes', b'{}') if include_raw else None
+            )
+            for record in records
+        ]
+        
+        async with self._acquire() as conn:
+            if len(rows) < NORMALIZED_COPY_MIN_ROWS:
+                await conn.execute(NORMALIZED_UNNEST_INSERT, *zip(*rows))
+                return
+            
+            # Inside a caller's transaction() this is only a savepoint, so
+            # ON COMMIT DROP wouldn't fire before the next batch; the staging
+            # table is dropped explicitly (a failure rolls its CREATE back)
+            async with conn.transaction():
+                await conn.execute(f"""
+                    CREATE TEMP TABLE crypto_data_stage AS
+                    SELECT {NORMALIZED_COLUMNS_SQL} FROM crypto_data WITH NO DATA
+                """)
+                await conn.copy_records_to_table(
+                    'crypto_data_stage', records=rows, columns=NORMALIZED_COLUMNS
                 )
+                await conn.execute(f"""
+                    INSERT INTO crypto_data ({NORMALIZED_COLUMNS_SQL})
+                    SELECT {NORMALIZED_COLUMNS_SQL} FROM crypto_data_stage
+                    ON CONFLICT (source, symbol, last_updated) DO NOTHING
+                """)
+                await conn.execute("DROP TABLE crypto_data_stage")
     
-    async def save_checkpoint(self, source: str, checkpoint_data: Dict, records_processed: int):
-        """Save ETL checkpoint"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO etl_checkpoints (source, checkpoint_data, records_processed)
-                VALUES ($1, $2, $3)
-            """, source, json.dumps(checkpoint_data), records_processed)
+    async def save_checkpoint(self, source: str, checkpoint_data: Dict, records_processed: int,
+                              completed: bool = False) -> int:
+        """
+        Save ETL checkpoint and return its id.
+        
+        With completed=True the checkpoint is recorded as final and any open
+        checkpoints for the source are closed in the same statement, in place
+        of a separate mark_checkpoint_completed round trip.
+        """
+        async with self._acquire() as conn:
+            return await conn.fetchval("""
+                WITH closed AS (
+                    UPDATE etl_checkpoints
+                    SET completed = TRUE
+                    WHERE source = $1 AND NOT completed AND $4
+                )
+                INSERT INTO etl_checkpoints (source, checkpoint_data, records_processed, completed)
+                VALUES ($1, $2, $3, $4)
+                RETURNING id
+            """, source, checkpoint_data, records_processed, completed)
     
     async def get_last_checkpoint(self, source: str) -> Optional[Dict]:
         """Get last checkpoint for a source"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow("""
                 SELECT checkpoint_data, records_processed
                 FROM etl_checkpoints
@@ -361,50 +701,65 @@ class DatabaseService:
             
             if row:
                 return {
-                    "data": json.loads(row['checkpoint_data']),
+                    "data": row['checkpoint_data'],
                     "records_processed": row['records_processed']
                 }
             return None
     
     async def mark_checkpoint_completed(self, source: str):
         """Mark checkpoint as completed"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
                 UPDATE etl_checkpoints
                 SET completed = TRUE
                 WHERE source = $1 AND NOT completed
             """, source)
     
-    async def log_run(self, source: str, status: str, records: int, 
-                     start_time: datetime, end_time: datetime = None, 
-                     error: str = None, metadata: Dict = None):
-        """Log ETL run"""
-        duration = (end_time - start_time).total_seconds() if end_time else None
-        
-        async with self.pool.acquire() as conn:
+    async def start_run(self, source: str) -> int:
+        """Record an ETL run as running and return its id"""
+        # start_time comes from the database clock
+        async with self._acquire() as conn:
+            return await conn.fetchval("""
+                INSERT INTO etl_runs (source, status)
+                VALUES ($1, 'running')
+                RETURNING id
+            """, source)
+    
+    async def finish_run(self, run_id: int, status: str, records: int,
+                         error: str = None, metadata: Dict = None):
+        """Move a run started with start_run to its final status"""
+        # duration_seconds is generated from start_time/end_time
+        async with self._acquire() as conn:
             await conn.execute("""
-                INSERT INTO etl_runs 
-                (source, status, records_processed, start_time, end_time, duration_seconds, error_message, metadata)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-            """, source, status, records, start_time, end_time, duration, error, 
-                json.dumps(metadata) if metadata else None)
+                UPDATE etl_runs
+                SET status = $2, records_processed = $3, end_time = clock_timestamp(),
+                    error_message = $4, metadata = $5
+                WHERE id = $1
+            """, run_id, status, records, error, metadata or None)
+        
+        # Make the finished run visible on /stats, /metrics and /runs right away
+        DatabaseService.get_etl_stats.cache_clear()
+        DatabaseService.get_recent_runs.cache_clear()
     
     async def log_schema_drift(self, source: str, expected: Dict, actual: Dict, 
                                confidence: float, warnings: List[str]):
         """Log schema drift detection"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
                 INSERT INTO schema_drift_logs 
                 (source, expected_schema, actual_schema, confidence_score, warnings)
                 VALUES ($1, $2, $3, $4, $5)
-            """, source, json.dumps(expected), json.dumps(actual), confidence, warnings)
+            """, source, expected, actual, confidence, warnings)
 
-async def get_db():
-    """Dependency to get database service"""
-    db = DatabaseService()
-    await db.initialize()
-    try:
-        yield db
-    finally:
-        if db.pool:
-            await db.pool.close()
\ No newline at end of file
+    async def close(self):
+        """Close the connection pool"""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+# Process-wide service; the app lifespan opens and closes its pool
+db_service = DatabaseService()
+
+async def get_db() -> DatabaseService:
+    """Dependency to get the shared database service (opened by the app lifespan)"""
+    return db_service
\ No newline at end of file
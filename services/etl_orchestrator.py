@@ -2,8 +2,10 @@
 ETL Orchestrator to manage all data ingestion pipelines
 """
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import asyncio
+import time
+import aiohttp
 
 from ingestion.coinpaprika_pipeline import CoinPaprikaPipeline
 from ingestion.coingecko_pipeline import CoinGeckoPipeline
@@ -16,11 +18,11 @@ logger = setup_logger(__name__)
 class ETLOrchestrator:
     """Orchestrates all ETL pipelines"""
     
-    def __init__(self, db: DatabaseService):
+    def __init__(self, db: DatabaseService, session: Optional[aiohttp.ClientSession] = None):
         self.db = db
         self.pipelines = {
-            "coinpaprika": CoinPaprikaPipeline(db),
-            "coingecko": CoinGeckoPipeline(db),
+            "coinpaprika": CoinPaprikaPipeline(db, session),
+            "coingecko": CoinGeckoPipeline(db, session),
             "csv": CSVPipeline(db)
         }
     
@@ -28,29 +30,39 @@ class ETLOrchestrator:
         """Run all ETL pipelines"""
         logger.info("🚀 Starting full ETL run")
         start_time = datetime.now()
+        start_perf = time.perf_counter()
         
         results = {}
         total_records = 0
         failed_sources = []
         
-        for source_name, pipeline in self.pipelines.items():
-            try:
-                logger.info(f"Running pipeline for {source_name}")
-                result = await pipeline.run()
-                results[source_name] = result
-                total_records += result.get('records_processed', 0)
-                logger.info(f"✅ {source_name} completed: {result.get('records_processed', 0)} records")
-            except Exception as e:
-                logger.error(f"❌ {source_name} failed: {e}")
+        # Sources are independent, so run them concurrently
+        logger.info(f"Running pipelines for {', '.join(self.pipelines)}")
+        outcomes = await asyncio.gather(
+            *(pipeline.run() for pipeline in self.pipelines.values()),
+            return_exceptions=True
+        )
+        
+        for source_name, outcome in zip(self.pipelines, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"❌ {source_name} failed: {outcome}")
                 results[source_name] = {
                     "status": "failed",
-                    "error": str(e),
+                    "error": str(outcome),
                     "records_processed": 0
                 }
                 failed_sources.append(source_name)
+            else:
+                results[source_name] = outcome
+                total_records += outcome.get('records_processed', 0)
+                logger.info(f"✅ {source_name} completed: {outcome.get('records_processed', 0)} records")
+        
+        # One refresh covers every source
+        if len(failed_sources) < len(self.pipelines):
+            await self._refresh_stats()
         
         end_time = datetime.now()
-        duration = (end_time - start_time).total_seconds()
+        duration = time.perf_counter() - start_perf
         
         overall_status = "success" if not failed_sources else "partial_failure"
         if len(failed_sources) == len(self.pipelines):
@@ -75,33 +87,17 @@ class ETLOrchestrator:
             raise ValueError(f"Unknown source: {source}")
         
         logger.info(f"Running ETL for {source}")
-        start_time = datetime.now()
         
+        # The pipeline records its own etl_runs row and refreshes the stats
         try:
-            result = await self.pipelines[source].run()
-            end_time = datetime.now()
-            
-            await self.db.log_run(
-                source=source,
-                status="success",
-                records=result.get('records_processed', 0),
-                start_time=start_time,
-                end_time=end_time,
-                metadata=result
-            )
-            
-            return result
+            return await self.pipelines[source].run(refresh_stats=True)
         except Exception as e:
-            end_time = datetime.now()
             logger.error(f"ETL failed for {source}: {e}")
-            
-            await self.db.log_run(
-                source=source,
-                status="failed",
-                records=0,
-                start_time=start_time,
-                end_time=end_time,
-                error=str(e)
-            )
-            
-            raise
\ No newline at end of file
+            raise
+    
+    async def _refresh_stats(self):
+        """Refresh the per-source counts; a failure here doesn't fail the run"""
+        try:
+            await self.db.refresh_stats()
+        except Exception as e:
+            logger.error(f"Failed to refresh ETL stats: {e}")
@@ -0,0 +1,25 @@
+"""
+Shared HTTP client session for the API pipelines
+"""
+from typing import Optional
+import aiohttp
+import orjson
+from fastapi import Request
+
+from core.config import settings
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Create a pooled ClientSession; the caller is responsible for closing it"""
+    connector = aiohttp.TCPConnector(
+        limit=settings.HTTP_POOL_LIMIT,
+        ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL
+    )
+    # aiohttp expects a str-returning serializer for request bodies
+    return aiohttp.ClientSession(
+        connector=connector,
+        json_serialize=lambda obj: orjson.dumps(obj).decode()
+    )
+
+def get_http_session(request: Request) -> Optional[aiohttp.ClientSession]:
+    """Dependency to get the app-wide HTTP session (None outside the app lifespan)"""
+    return getattr(request.app.state, "http_session", None)
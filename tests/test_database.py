@@ -0,0 +1,251 @@
+"""
+PostgreSQL-backed tests for DatabaseService; skipped when no database is reachable
+"""
+import uuid
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import asyncpg
+import pytest
+import pytest_asyncio
+
+from core.config import settings
+from services.database import DatabaseService, NORMALIZED_COPY_MIN_ROWS, _init_connection
+
+# Tables as created by the first release, before the column type changes,
+# raw table partitioning and the generated run duration
+BASELINE_SCHEMA = """
+    CREATE TABLE raw_coinpaprika (
+        id SERIAL PRIMARY KEY, data JSONB NOT NULL,
+        ingested_at TIMESTAMP DEFAULT NOW(), source_id VARCHAR(255)
+    );
+    CREATE TABLE raw_coingecko (
+        id SERIAL PRIMARY KEY, data JSONB NOT NULL,
+        ingested_at TIMESTAMP DEFAULT NOW(), source_id VARCHAR(255)
+    );
+    CREATE TABLE raw_csv (
+        id SERIAL PRIMARY KEY, data JSONB NOT NULL,
+        ingested_at TIMESTAMP DEFAULT NOW(), source_id VARCHAR(255)
+    );
+    CREATE TABLE crypto_data (
+        id SERIAL PRIMARY KEY,
+        source VARCHAR(50) NOT NULL,
+        symbol VARCHAR(50) NOT NULL,
+        name VARCHAR(255),
+        price_usd DECIMAL(20, 8),
+        market_cap_usd DECIMAL(20, 2),
+        volume_24h_usd DECIMAL(20, 2),
+        percent_change_24h DECIMAL(10, 4),
+        rank INTEGER,
+        last_updated TIMESTAMP,
+        ingested_at TIMESTAMP DEFAULT NOW(),
+        raw_data JSONB,
+        UNIQUE(source, symbol, last_updated)
+    );
+    CREATE INDEX idx_crypto_source ON crypto_data(source);
+    CREATE INDEX idx_crypto_updated ON crypto_data(last_updated);
+    CREATE TABLE etl_checkpoints (
+        id SERIAL PRIMARY KEY,
+        source VARCHAR(50) NOT NULL,
+        checkpoint_data JSONB NOT NULL,
+        records_processed INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT NOW(),
+        completed BOOLEAN DEFAULT FALSE
+    );
+    CREATE TABLE etl_runs (
+        id SERIAL PRIMARY KEY,
+        source VARCHAR(50) NOT NULL,
+        status VARCHAR(50) NOT NULL,
+        records_processed INTEGER DEFAULT 0,
+        start_time TIMESTAMP NOT NULL,
+        end_time TIMESTAMP,
+        duration_seconds DECIMAL(10, 2),
+        error_message TEXT,
+        metadata JSONB
+    );
+    INSERT INTO crypto_data (source, symbol, name, price_usd, market_cap_usd, volume_24h_usd,
+                             percent_change_24h, rank, last_updated)
+    VALUES ('coinpaprika', 'OLD', 'Legacy Coin', 1.5, 100, 10, 0.25, 1, '2024-01-01 00:00:00'),
+           ('coinpaprika', 'UNDATED', 'Undated Coin', 2.5, 200, 20, 0.5, 2, NULL);
+    INSERT INTO etl_runs (source, status, records_processed, start_time, end_time, duration_seconds)
+    VALUES ('coinpaprika', 'success', 1, '2024-01-01 00:00:00', '2024-01-01 00:00:03', 3);
+"""
+
+@pytest_asyncio.fixture(params=["fresh", "baseline"])
+async def db(request):
+    """DatabaseService on a throwaway schema, either empty or at the baseline release"""
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    try:
+        admin = await asyncpg.connect(settings.DATABASE_URL, timeout=2)
+    except (OSError, asyncpg.PostgresError) as e:
+        pytest.skip(f"PostgreSQL not available: {e}")
+    
+    await admin.execute(f"CREATE SCHEMA {schema}")
+    if request.param == "baseline":
+        await admin.execute(f"SET search_path TO {schema}; {BASELINE_SCHEMA}")
+    
+    service = DatabaseService()
+    service.pool = await asyncpg.create_pool(
+        settings.DATABASE_URL, min_size=1, max_size=2, init=_init_connection,
+        server_settings={"search_path": schema}
+    )
+    DatabaseService.get_etl_stats.cache_clear()
+    DatabaseService.get_recent_runs.cache_clear()
+    try:
+        await service.create_tables()
+        # Every upgrade step is safe to repeat on the next start
+        await service.create_tables()
+        yield service
+    finally:
+        await service.close()
+        await admin.execute(f"DROP SCHEMA {schema} CASCADE")
+        await admin.close()
+
+def make_records(count, start=datetime(2024, 6, 1), source="coingecko"):
+    """Distinct normalized records, one second apart"""
+    return [
+        {
+            "source": source,
+            "symbol": f"C{i}",
+            "name": f"Coin {i}",
+            "price_usd": 1.0 + i,
+            "market_cap_usd": 100.0,
+            "volume_24h_usd": 10.0,
+            "percent_change_24h": -0.5,
+            "rank": i,
+            "last_updated": start + timedelta(seconds=i),
+            "raw_bytes": f'{{"id": "coin{i}"}}'.encode()
+        }
+        for i in range(count)
+    ]
+
+async def column_info(service, table, column):
+    async with service.pool.acquire() as conn:
+        return await conn.fetchrow("""
+            SELECT data_type, is_nullable, is_generated FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = $1 AND column_name = $2
+        """, table, column)
+
+@pytest.mark.asyncio
+async def test_create_tables_leaves_current_column_types(db):
+    """Test fresh and upgraded schemas end up with the same column definitions"""
+    for column in ("price_usd", "market_cap_usd", "volume_24h_usd", "percent_change_24h"):
+        assert (await column_info(db, "crypto_data", column))["data_type"] == "double precision"
+    assert (await column_info(db, "crypto_data", "last_updated"))["is_nullable"] == "NO"
+    
+    duration = await column_info(db, "etl_runs", "duration_seconds")
+    assert duration["data_type"] == "double precision"
+    assert duration["is_generated"] == "ALWAYS"
+    for column in ("start_time", "end_time"):
+        assert (await column_info(db, "etl_runs", column))["data_type"] == "timestamp with time zone"
+    
+    with pytest.raises(asyncpg.CheckViolationError):
+        await db.save_normalized_data([{**make_records(1)[0], "price_usd": -1.0}])
+
+@pytest.mark.asyncio
+async def test_save_normalized_data_both_paths_are_idempotent(db):
+    """Test the INSERT and COPY paths, twice each inside one transaction"""
+    small = make_records(3, source="coinpaprika")
+    large = make_records(NORMALIZED_COPY_MIN_ROWS + 100)
+    
+    async with db.transaction() as tx:
+        for _ in range(2):
+            await tx.save_normalized_data(small)
+            await tx.save_normalized_data(large, include_raw=False)
+        await tx.save_raw_data("coingecko", [(r["raw_bytes"], r["symbol"]) for r in small])
+    
+    async with db.pool.acquire() as conn:
+        counts = dict(await conn.fetch(
+            "SELECT source, COUNT(*) FROM crypto_data WHERE symbol LIKE 'C%' GROUP BY source"
+        ))
+        raw_count = await conn.fetchval("SELECT COUNT(*) FROM raw_coingecko")
+        stored_raw = await conn.fetchval(
+            "SELECT raw_data FROM crypto_data WHERE source = 'coinpaprika' AND symbol = 'C1'"
+        )
+    
+    assert counts == {"coinpaprika": 3, "coingecko": NORMALIZED_COPY_MIN_ROWS + 100}
+    assert raw_count == 3
+    assert stored_raw == {"id": "coin1"}
+
+@pytest.mark.asyncio
+async def test_get_data_pages_by_cursor_and_filters(db):
+    """Test keyset pages don't overlap and filters reach the SQL"""
+    await db.save_normalized_data(make_records(5))
+    filters = {"source": "coingecko"}
+    
+    first = await db.get_data(2, filters)
+    second = await db.get_data(2, filters, cursor=first["next_cursor"])
+    last = await db.get_data(2, filters, cursor=second["next_cursor"])
+    
+    symbols = [row["symbol"] for page in (first, second, last) for row in page["data"]]
+    assert symbols == ["C4", "C3", "C2", "C1", "C0"]
+    assert last["has_more"] is False and last["next_cursor"] is None
+    assert isinstance(first["data"][0]["price_usd"], float)
+    
+    by_offset = await db.get_data(2, filters, page=2)
+    assert [row["symbol"] for row in by_offset["data"]] == ["C2", "C1"]
+    
+    cheap = await db.get_data(10, {"max_price": 2.0, "raw": {"id": "coin1"}})
+    assert [row["symbol"] for row in cheap["data"]] == ["C1"]
+    
+    with pytest.raises(ValueError):
+        await db.get_data(2, filters, cursor="not-a-cursor")
+    
+    # Legacy rows are paged through like any other
+    everything = await db.get_data(1, {})
+    while everything["has_more"]:
+        everything = await db.get_data(1, {}, cursor=everything["next_cursor"])
+
+@pytest.mark.asyncio
+async def test_runs_and_stats(db):
+    """Test finished runs get a duration and stats count stored rows"""
+    run_id = await db.start_run("coingecko")
+    await db.save_normalized_data(make_records(4))
+    await db.finish_run(run_id, status="success", records=4, metadata={"raw_count": 4})
+    await db.refresh_stats()
+    
+    runs = await db.get_recent_runs(limit=10)
+    assert runs[0]["id"] == run_id
+    assert runs[0]["status"] == "success"
+    assert isinstance(runs[0]["duration_seconds"], float)
+    assert all(run["duration_seconds"] is not None for run in runs)
+    
+    stats = await db.get_etl_stats()
+    assert stats["by_source"]["coingecko"] == 4
+    assert stats["total_records"] == sum(stats["by_source"].values())
+    assert stats["successful_runs"] == len(runs)
+
+@pytest.mark.asyncio
+async def test_completed_checkpoint_closes_open_ones(db):
+    """Test the final checkpoint closes the source's open checkpoints"""
+    await db.save_checkpoint("coingecko", {"last_page": 1}, 100)
+    assert (await db.get_last_checkpoint("coingecko"))["data"] == {"last_page": 1}
+    
+    await db.save_checkpoint("coingecko", {"last_page": 2}, 200, completed=True)
+    assert await db.get_last_checkpoint("coingecko") is None
+
+@pytest.mark.asyncio
+async def test_restart_moves_default_partition_rows_into_new_month(db):
+    """Test rows that overflowed into the DEFAULT partition don't block its month's partition"""
+    async with db.pool.acquire() as conn:
+        if await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = 'raw_csv'::regclass") != "p":
+            pytest.skip("raw tables predate partitioning")
+        
+        # The first month past the pre-created window
+        month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        for _ in range(settings.RAW_PARTITION_MONTHS_AHEAD + 1):
+            month = (month + timedelta(days=32)).replace(day=1)
+        await conn.execute(
+            "INSERT INTO raw_csv (data, ingested_at, source_id) VALUES ('{}', $1, 'late')",
+            month + timedelta(days=3)
+        )
+    
+    # The next start covers one more month
+    longer = settings.model_copy(update={"RAW_PARTITION_MONTHS_AHEAD": settings.RAW_PARTITION_MONTHS_AHEAD + 1})
+    with patch("services.database.settings", longer):
+        await db.create_tables()
+    
+    async with db.pool.acquire() as conn:
+        assert await conn.fetchval(f"SELECT source_id FROM raw_csv_{month:%Y_%m}") == "late"
+        assert await conn.fetchval("SELECT COUNT(*) FROM raw_csv_default") == 0
+        assert await conn.fetchval("SELECT COUNT(*) FROM raw_csv") == 1
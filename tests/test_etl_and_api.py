@@ -5,29 +5,52 @@ import pytest
 import asyncio
 from datetime import datetime
 from decimal import Decimal
-from unittest.mock import Mock, patch, AsyncMock
+from itertools import pairwise
+import orjson
+from contextlib import asynccontextmanager
+from unittest.mock import Mock, MagicMock, patch, AsyncMock
 from fastapi.testclient import TestClient
 
 from main import app
-from services.database import DatabaseService
+from api.responses import ORJSONResponse
+from core.config import settings
+from services.database import DatabaseService, encode_cursor, decode_cursor, get_db, _data_query
 from services.etl_orchestrator import ETLOrchestrator
 from ingestion.coinpaprika_pipeline import CoinPaprikaPipeline
 from ingestion.coingecko_pipeline import CoinGeckoPipeline
 from ingestion.csv_pipeline import CSVPipeline
-
-# Test client
-client = TestClient(app)
+from ingestion.rate_limiter import AsyncRateLimiter
+from core.cache import async_ttl_cache
 
 # Mock database for testing
 class MockDatabase:
+    __slots__ = ("data", "checkpoints", "runs", "drift_logs", "stats_refreshes")
+    
     def __init__(self):
-        self.data = []
+        # Keyed like crypto_data's unique constraint, so re-saves are no-ops
+        self.data = {}
         self.checkpoints = {}
         self.runs = []
+        self.drift_logs = []
+        self.stats_refreshes = 0
+    
+    def clear(self):
+        self.data.clear()
+        self.checkpoints.clear()
+        self.runs.clear()
+        self.drift_logs.clear()
+        self.stats_refreshes = 0
     
     async def initialize(self):
         pass
     
+    async def close(self):
+        pass
+    
+    @asynccontextmanager
+    async def transaction(self):
+        yield self
+    
     async def check_health(self):
         return True
     
@@ -38,11 +61,13 @@ class MockDatabase:
             "last_success": datetime.now().isoformat()
         }
     
-    async def get_data(self, page, page_size, filters):
+    async def get_data(self, page_size, filters, cursor=None, page=None):
+        if cursor is not None:
+            decode_cursor(cursor)
         return {
-            "data": self.data[:page_size],
-            "total": len(self.data),
-            "total_pages": 1
+            "data": list(self.data.values())[:page_size],
+            "has_more": len(self.data) > page_size,
+            "next_cursor": None
         }
     
     async def get_etl_stats(self):
@@ -57,20 +82,27 @@ class MockDatabase:
             "failed_runs": 0
         }
     
+    async def refresh_stats(self):
+        self.stats_refreshes += 1
+    
     async def get_recent_runs(self, limit):
         return self.runs[:limit]
     
-    async def save_normalized_data(self, records):
-        self.data.extend(records)
+    async def save_normalized_data(self, records, include_raw=True):
+        for record in records:
+            key = (record["source"], record["symbol"], record["last_updated"])
+            self.data.setdefault(key, record)
     
-    async def save_raw_data(self, source, data, source_ids=None):
+    async def save_raw_data(self, source, rows):
         pass
     
-    async def save_checkpoint(self, source, checkpoint_data, records_processed):
+    async def save_checkpoint(self, source, checkpoint_data, records_processed, completed=False):
         self.checkpoints[source] = {
             "data": checkpoint_data,
-            "records_processed": records_processed
+            "records_processed": records_processed,
+            "completed": completed
         }
+        return len(self.checkpoints)
     
     async def get_last_checkpoint(self, source):
         return self.checkpoints.get(source)
@@ -79,23 +111,43 @@ class MockDatabase:
         if source in self.checkpoints:
             self.checkpoints[source]["completed"] = True
     
-    async def log_run(self, source, status, records, start_time, end_time=None, error=None, metadata=None):
+    async def start_run(self, source):
         self.runs.append({
             "source": source,
-            "status": status,
-            "records_processed": records,
-            "start_time": start_time,
-            "end_time": end_time
+            "status": "running",
+            "records_processed": 0,
+            "start_time": datetime.now(),
+            "end_time": None
         })
+        return len(self.runs)
+    
+    async def finish_run(self, run_id, status, records, error=None, metadata=None):
+        self.runs[run_id - 1].update(
+            status=status,
+            records_processed=records,
+            end_time=datetime.now()
+        )
     
     async def log_schema_drift(self, source, expected, actual, confidence, warnings):
-        pass
+        self.drift_logs.append({"source": source, "warnings": warnings})
+
+@pytest.fixture(scope="session")
+def client():
+    """One app lifespan for all API tests, backed by MockDatabase"""
+    # The lifespan opens and closes the same service requests get from get_db
+    mock_service = MockDatabase()
+    app.dependency_overrides[get_db] = lambda: mock_service
+    no_startup_etl = settings.model_copy(update={"RUN_ETL_ON_STARTUP": False})
+    with patch("main.db_service", mock_service), patch("main.settings", no_startup_etl):
+        with TestClient(app) as test_client:
+            yield test_client
+    app.dependency_overrides.clear()
 
 # ========================================
 # API Endpoint Tests
 # ========================================
 
-def test_root_endpoint():
+def test_root_endpoint(client):
     """Test root endpoint returns correct info"""
     response = client.get("/")
     assert response.status_code == 200
@@ -104,7 +156,7 @@ def test_root_endpoint():
     assert "version" in data
     assert "endpoints" in data
 
-def test_health_endpoint():
+def test_health_endpoint(client):
     """Test health check endpoint"""
     response = client.get("/health")
     assert response.status_code == 200
@@ -114,19 +166,61 @@ def test_health_endpoint():
     assert "request_id" in data
     assert "api_latency_ms" in data
 
-def test_data_endpoint_pagination():
+def test_data_endpoint_pagination(client):
     """Test data endpoint with pagination"""
     response = client.get("/data?page=1&page_size=10")
     assert response.status_code == 200
     data = response.json()
     assert "data" in data
-    assert "total_records" in data
+    assert "total_records" not in data
     assert "page" in data
     assert "page_size" in data
     assert data["page"] == 1
     assert data["page_size"] == 10
+    assert "next_cursor" in data
+    assert "has_more" in data
 
-def test_data_endpoint_filtering():
+def test_data_endpoint_raw_containment_filter(client):
+    """Test that the raw filter is parsed and echoed back"""
+    response = client.get('/data?raw={"id":"btc-bitcoin"}')
+    assert response.status_code == 200
+    assert response.json()["filters"]["raw"] == {"id": "btc-bitcoin"}
+    
+    response = client.get('/data?raw=[1,2]')
+    assert response.status_code == 400
+    
+    # CSV rows have no raw_data to match against
+    response = client.get('/data?source=csv&raw={"symbol":"BTC"}')
+    assert response.status_code == 400
+
+def test_data_endpoint_rejects_bad_cursor(client):
+    """Test that a malformed cursor is a client error"""
+    response = client.get("/data?cursor=not-a-cursor")
+    assert response.status_code == 400
+
+def test_cursor_round_trip():
+    """Test keyset cursor encoding"""
+    row = {"last_updated": datetime(2024, 1, 15, 10, 30), "id": 42}
+    assert decode_cursor(encode_cursor(row)) == (row["last_updated"], 42)
+
+def test_data_endpoint_cursor_ignores_page(client):
+    """Test that a cursor request doesn't echo the unused page number"""
+    cursor = encode_cursor({"last_updated": datetime(2024, 1, 15, 10, 30), "id": 42})
+    response = client.get(f"/data?cursor={cursor}&page=3")
+    assert response.status_code == 200
+    assert response.json()["page"] is None
+
+def test_keyset_query_has_no_offset():
+    """Test cursor pages bind no OFFSET; page-number queries keep it"""
+    assert "OFFSET" not in _data_query(("source",), True)
+    assert "OFFSET $3" in _data_query(("source",), False)
+
+def test_response_encodes_decimal_as_string():
+    """Test NUMERIC values from older schemas still render"""
+    response = ORJSONResponse({"price_usd": Decimal("45000.50")})
+    assert orjson.loads(response.body) == {"price_usd": "45000.50"}
+
+def test_data_endpoint_filtering(client):
     """Test data endpoint with filters"""
     response = client.get("/data?source=coinpaprika&symbol=BTC")
     assert response.status_code == 200
@@ -135,7 +229,7 @@ def test_data_endpoint_filtering():
     assert data["filters"]["source"] == "coinpaprika"
     assert data["filters"]["symbol"] == "BTC"
 
-def test_data_endpoint_price_filter():
+def test_data_endpoint_price_filter(client):
     """Test data endpoint with price filters"""
     response = client.get("/data?min_price=100&max_price=50000")
     assert response.status_code == 200
@@ -144,7 +238,7 @@ def test_data_endpoint_price_filter():
     assert data["filters"]["min_price"] == 100
     assert data["filters"]["max_price"] == 50000
 
-def test_stats_endpoint():
+def test_stats_endpoint(client):
     """Test stats endpoint"""
     response = client.get("/stats")
     assert response.status_code == 200
@@ -153,7 +247,7 @@ def test_stats_endpoint():
     assert "records_by_source" in data
     assert "total_runs" in data
 
-def test_runs_endpoint():
+def test_runs_endpoint(client):
     """Test runs endpoint"""
     response = client.get("/runs?limit=5")
     assert response.status_code == 200
@@ -161,22 +255,69 @@ def test_runs_endpoint():
     assert "runs" in data
     assert "count" in data
 
-def test_metrics_endpoint():
+def test_metrics_endpoint(client):
     """Test metrics endpoint (Prometheus format)"""
     response = client.get("/metrics")
     assert response.status_code == 200
-    data = response.json()
-    assert "metrics" in data
-    assert "timestamp" in data
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE etl_total_records gauge" in response.text
+    assert "etl_total_runs " in response.text
+
+@pytest.mark.asyncio
+async def test_ttl_cache_reuses_result_until_cleared():
+    """Test the stats/runs cache serves repeats and honours cache_clear"""
+    calls = []
+    
+    class Service:
+        @async_ttl_cache(60)
+        async def fetch(self, limit):
+            calls.append(limit)
+            return {"limit": limit}
+    
+    service = Service()
+    first = await service.fetch(10)
+    assert await service.fetch(10) is first
+    assert await Service().fetch(10) is first  # Shared across instances
+    await service.fetch(5)
+    assert calls == [10, 5]
+    
+    Service.fetch.cache_clear()
+    await service.fetch(10)
+    assert calls == [10, 5, 10]
+
+@pytest.mark.asyncio
+async def test_ttl_cache_misses_dont_block_other_keys():
+    """Test a slow miss is shared by its callers without stalling hits"""
+    calls = []
+    release = asyncio.Event()
+    
+    class Service:
+        @async_ttl_cache(60)
+        async def fetch(self, limit):
+            calls.append(limit)
+            if limit == 50:
+                await release.wait()
+            return limit
+    
+    service = Service()
+    await service.fetch(5)
+    slow = [asyncio.create_task(service.fetch(50)) for _ in range(2)]
+    await asyncio.sleep(0)
+    
+    # Served from the cache while the limit=50 query is still running
+    assert await asyncio.wait_for(service.fetch(5), timeout=1) == 5
+    
+    release.set()
+    assert await asyncio.gather(*slow) == [50, 50]
+    assert calls == [5, 50]  # The concurrent misses made one call
 
 # ========================================
 # ETL Transformation Tests
 # ========================================
 
 @pytest.mark.asyncio
-async def test_coinpaprika_transform():
+async def test_coinpaprika_transform(mock_db):
     """Test CoinPaprika transformation logic"""
-    mock_db = MockDatabase()
     pipeline = CoinPaprikaPipeline(mock_db)
     
     raw_data = [
@@ -203,12 +344,11 @@ async def test_coinpaprika_transform():
     assert transformed[0]["symbol"] == "BTC"
     assert transformed[0]["name"] == "Bitcoin"
     assert transformed[0]["rank"] == 1
-    assert isinstance(transformed[0]["price_usd"], Decimal)
+    assert transformed[0]["price_usd"] == 45000.5
 
 @pytest.mark.asyncio
-async def test_coingecko_transform():
+async def test_coingecko_transform(mock_db):
     """Test CoinGecko transformation logic"""
-    mock_db = MockDatabase()
     pipeline = CoinGeckoPipeline(mock_db)
     
     raw_data = [
@@ -230,16 +370,158 @@ async def test_coingecko_transform():
     assert transformed[0]["source"] == "coingecko"
     assert transformed[0]["symbol"] == "BTC"  # Should be uppercase
     assert transformed[0]["name"] == "Bitcoin"
+    assert orjson.loads(transformed[0]["raw_bytes"]) == raw_data[0]  # Raw payload pre-serialized
+
+@pytest.mark.asyncio
+async def test_transform_drops_negative_amounts(mock_db):
+    """Test negative prices are rejected in validation, ahead of the DB CHECKs"""
+    pipeline = CoinGeckoPipeline(mock_db)
+    
+    raw_data = [
+        {"id": "bitcoin", "symbol": "btc", "name": "Bitcoin", "current_price": 45000.5},
+        {"id": "bad", "symbol": "bad", "name": "Bad", "current_price": -1}
+    ]
+    
+    transformed = await pipeline.transform(raw_data)
+    
+    assert [r["symbol"] for r in transformed] == ["BTC"]
+
+@pytest.mark.asyncio
+async def test_transform_shares_batch_timestamp(mock_db):
+    """Test every record in a batch carries the same last_updated"""
+    pipeline = CoinGeckoPipeline(mock_db)
+    
+    raw_data = [
+        {"id": f"coin{i}", "symbol": f"c{i}", "name": f"Coin {i}", "current_price": 1.0}
+        for i in range(50)
+    ]
+    
+    with patch("ingestion.coingecko_pipeline.datetime", wraps=datetime) as clock:
+        transformed = await pipeline.transform(raw_data)
+    
+    assert clock.now.call_count == 1  # Taken once per batch, not per record
+    assert len({r["last_updated"] for r in transformed}) == 1
 
 @pytest.mark.asyncio
-async def test_csv_transform():
+async def test_coingecko_extract_fetches_pages_concurrently(mock_db):
+    """Test CoinGecko pages are fetched in parallel and flattened in order"""
+    pipeline = CoinGeckoPipeline(mock_db)
+    in_flight = 0
+    max_in_flight = 0
+    
+    async def fake_fetch_page(session, headers, page):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        # Later pages finish first; results must still come back in page order
+        await asyncio.sleep(0.01 * (3 - page))
+        in_flight -= 1
+        return [{"page": page}]
+    
+    pipeline._fetch_page = fake_fetch_page
+    
+    # Settings are frozen - swap in a modified copy instead of mutating
+    paged_settings = settings.model_copy(update={"COINGECKO_PAGES": 3, "COINGECKO_PAGE_CONCURRENCY": 3})
+    with patch("ingestion.coingecko_pipeline.settings", paged_settings):
+        data = await pipeline.extract()
+    
+    assert data == [{"page": 1}, {"page": 2}, {"page": 3}]
+    assert max_in_flight == 3  # All pages requested at once, not one after another
+
+@pytest.mark.asyncio
+async def test_coingecko_run_loads_each_page(mock_db):
+    """Test run() streams CoinGecko pages into load one batch at a time"""
+    pipeline = CoinGeckoPipeline(mock_db)
+    
+    async def fake_fetch_page(session, headers, page):
+        return [{"id": f"coin{page}", "symbol": f"c{page}", "name": f"Coin {page}", "current_price": page}]
+    
+    pipeline._fetch_page = fake_fetch_page
+    
+    paged_settings = settings.model_copy(update={"COINGECKO_PAGES": 3})
+    with patch("ingestion.coingecko_pipeline.settings", paged_settings), \
+            patch.object(pipeline, "load", wraps=pipeline.load) as load:
+        await pipeline.run()
+        mock_db.clear()
+        # Page progress restarts with every run
+        result = await pipeline.run()
+    
+    assert load.call_count == 6
+    assert result["records_processed"] == 3
+    assert [r["symbol"] for r in mock_db.data.values()] == ["C1", "C2", "C3"]
+    assert mock_db.checkpoints["coingecko"]["data"] == {"last_page": 3, "last_index": 3}
+    assert mock_db.checkpoints["coingecko"]["completed"] is True
+
+@pytest.mark.asyncio
+async def test_coingecko_checkpoint_uses_fetched_page_numbers(mock_db):
+    """Test empty pages don't shift page numbers or leave the checkpoint open"""
+    pipeline = CoinGeckoPipeline(mock_db)
+    
+    async def fake_fetch_page(session, headers, page):
+        if page in (2, 4):
+            return []  # Past the available coins
+        return [{"id": f"coin{page}", "symbol": f"c{page}", "name": f"Coin {page}", "current_price": page}]
+    
+    pipeline._fetch_page = fake_fetch_page
+    saved = []
+    
+    async def record_checkpoint(self, source, checkpoint_data, records_processed, completed=False):
+        saved.append((checkpoint_data, completed))
+        self.checkpoints[source] = {
+            "data": checkpoint_data, "records_processed": records_processed, "completed": completed
+        }
+    
+    paged_settings = settings.model_copy(update={"COINGECKO_PAGES": 4})
+    with patch("ingestion.coingecko_pipeline.settings", paged_settings), \
+            patch.object(MockDatabase, "save_checkpoint", autospec=True, side_effect=record_checkpoint):
+        result = await pipeline.run()
+    
+    assert result["status"] == "success"
+    assert saved == [
+        ({"last_page": 1, "last_index": 1}, False),
+        ({"last_page": 3, "last_index": 2}, False)
+    ]
+    assert mock_db.checkpoints["coingecko"]["completed"] is True  # Closed once extraction ended
+
+@pytest.mark.asyncio
+async def test_failed_run_reports_loaded_rows_and_stops_fetching(mock_db):
+    """Test a run failing mid-way logs the rows already committed and leaves no fetches behind"""
+    pipeline = CoinGeckoPipeline(mock_db)
+    
+    async def fake_fetch_page(session, headers, page):
+        if page == 3:
+            await asyncio.Event().wait()  # Never arrives
+        return [{"id": f"coin{page}", "symbol": f"c{page}", "name": f"Coin {page}", "current_price": page}]
+    
+    load_page = pipeline.load
+    
+    async def load_until_second_page(normalized_data):
+        if normalized_data[0]["symbol"] == "C2":
+            raise RuntimeError("Disk full")
+        await load_page(normalized_data)
+    
+    pipeline._fetch_page = fake_fetch_page
+    pipeline.load = load_until_second_page
+    
+    paged_settings = settings.model_copy(update={"COINGECKO_PAGES": 3})
+    with patch("ingestion.coingecko_pipeline.settings", paged_settings):
+        with pytest.raises(RuntimeError, match="Disk full"):
+            await pipeline.run()
+    
+    assert mock_db.runs[-1]["status"] == "failed"
+    assert mock_db.runs[-1]["records_processed"] == 1  # Page 1 was committed
+    assert mock_db.checkpoints["coingecko"]["data"] == {"last_page": 1, "last_index": 1}
+    assert mock_db.checkpoints["coingecko"]["completed"] is False  # Left open mid-way
+    assert asyncio.all_tasks() == {asyncio.current_task()}  # Page 3's fetch was cancelled
+
+@pytest.mark.asyncio
+async def test_csv_transform(mock_db):
     """Test CSV transformation logic"""
-    mock_db = MockDatabase()
     pipeline = CSVPipeline(mock_db)
     
     raw_data = [
         {
-            "symbol": "BTC",
+            "symbol": "btc",
             "name": "Bitcoin",
             "price": "45000.50",
             "market_cap": "850000000000",
@@ -253,16 +535,40 @@ async def test_csv_transform():
     
     assert len(transformed) == 1
     assert transformed[0]["source"] == "csv"
-    assert transformed[0]["symbol"] == "BTC"
+    assert transformed[0]["symbol"] == "BTC"  # Should be uppercase
+    assert transformed[0]["price_usd"] == 45000.5
+
+@pytest.mark.asyncio
+async def test_csv_pipeline_loads_in_chunks(tmp_path, mock_db):
+    """Test CSV file is streamed and loaded chunk by chunk"""
+    csv_path = tmp_path / "crypto.csv"
+    csv_path.write_text(
+        " symbol , name,price,market_cap,volume_24h,percent_change_24h,rank\n"
+        + "".join(f"C{i}, Coin {i} ,1.5,100,10,0.5,{i}\n" for i in range(5))
+    )
+    
+    pipeline = CSVPipeline(mock_db)
+    pipeline.csv_path = str(csv_path)
+    
+    chunked_settings = settings.model_copy(update={"CSV_CHUNK_SIZE": 2})
+    with patch("ingestion.csv_pipeline.settings", chunked_settings), \
+         patch.object(pipeline, "load", wraps=pipeline.load) as load:
+        result = await pipeline.run()
+    
+    assert result["records_processed"] == 5
+    assert load.call_count == 3  # 2 + 2 + 1
+    rows = list(mock_db.data.values())
+    assert [r["symbol"] for r in rows] == [f"C{i}" for i in range(5)]
+    assert rows[0]["name"] == "Coin 0"  # Values are stripped
+    assert len({r["last_updated"] for r in rows}) == 1  # One snapshot per file
 
 # ========================================
 # Incremental Ingestion Tests
 # ========================================
 
 @pytest.mark.asyncio
-async def test_checkpoint_save_and_retrieve():
+async def test_checkpoint_save_and_retrieve(mock_db):
     """Test checkpoint saving and retrieval"""
-    mock_db = MockDatabase()
     
     # Save checkpoint
     await mock_db.save_checkpoint(
@@ -279,9 +585,8 @@ async def test_checkpoint_save_and_retrieve():
     assert checkpoint["records_processed"] == 50
 
 @pytest.mark.asyncio
-async def test_checkpoint_completion():
+async def test_checkpoint_completion(mock_db):
     """Test marking checkpoint as completed"""
-    mock_db = MockDatabase()
     
     await mock_db.save_checkpoint(
         source="test_source",
@@ -299,53 +604,103 @@ async def test_checkpoint_completion():
 # ========================================
 
 @pytest.mark.asyncio
-async def test_pipeline_handles_extraction_failure():
+async def test_pipeline_handles_extraction_failure(mock_db, failing_extract):
     """Test pipeline handles extraction failures gracefully"""
-    mock_db = MockDatabase()
     pipeline = CoinPaprikaPipeline(mock_db)
     
     # Mock extract to raise exception
-    with patch.object(pipeline, 'extract', side_effect=Exception("Network error")):
-        with pytest.raises(Exception) as exc_info:
-            await pipeline.run()
-        
-        assert "Network error" in str(exc_info.value)
-        
-        # Check that error was logged
-        assert len(mock_db.runs) > 0
-        assert mock_db.runs[-1]["status"] == "failed"
+    pipeline.extract = failing_extract
+    with pytest.raises(Exception, match="Network error"):
+        await pipeline.run()
+    
+    # Check that error was logged on the run's one row
+    assert len(mock_db.runs) == 1
+    assert mock_db.runs[-1]["status"] == "failed"
+    assert mock_db.stats_refreshes == 0
 
 @pytest.mark.asyncio
-async def test_pipeline_handles_transform_failure():
+async def test_cancelled_run_is_finished_as_failed(mock_db):
+    """Test cancelling a run doesn't leave its row running"""
+    pipeline = CoinPaprikaPipeline(mock_db)
+    extracting = asyncio.Event()
+    
+    async def hanging_extract():
+        extracting.set()
+        await asyncio.Event().wait()
+    
+    pipeline.extract = hanging_extract
+    run = asyncio.create_task(pipeline.run())
+    await extracting.wait()
+    run.cancel()
+    
+    with pytest.raises(asyncio.CancelledError):
+        await run
+    
+    assert mock_db.runs[-1]["status"] == "failed"
+    assert mock_db.runs[-1]["end_time"] is not None
+
+@pytest.mark.asyncio
+async def test_pipeline_run_updates_a_single_run_row(mock_db):
+    """Test that a run is started as running and finished in place"""
+    pipeline = CoinPaprikaPipeline(mock_db)
+    
+    async def mock_extract():
+        return [{
+            "id": "btc-bitcoin", "name": "Bitcoin", "symbol": "BTC", "rank": 1,
+            "quotes": {"USD": {"price": 45000.5}}
+        }]
+    
+    pipeline.extract = mock_extract
+    await pipeline.run()
+    
+    assert len(mock_db.runs) == 1
+    assert mock_db.runs[0]["status"] == "success"
+    assert mock_db.runs[0]["records_processed"] == 1
+    assert mock_db.checkpoints["coinpaprika"]["completed"] is True
+    assert mock_db.stats_refreshes == 0  # Left to the orchestrator unless asked
+    
+    await pipeline.run(refresh_stats=True)
+    assert mock_db.stats_refreshes == 1
+
+@pytest.mark.asyncio
+async def test_stats_refresh_failure_doesnt_fail_run(mock_db):
+    """Test a failed stats refresh is logged but the run still succeeds"""
+    pipeline = CoinPaprikaPipeline(mock_db)
+    pipeline.extract = AsyncMock(return_value=[])
+    
+    with patch.object(MockDatabase, "refresh_stats", autospec=True, side_effect=Exception("locked")):
+        result = await pipeline.run(refresh_stats=True)
+    
+    assert result["status"] == "success"
+    assert mock_db.runs[0]["status"] == "success"
+
+@pytest.mark.asyncio
+async def test_pipeline_handles_transform_failure(mock_db):
     """Test pipeline handles transformation failures"""
-    mock_db = MockDatabase()
     pipeline = CoinPaprikaPipeline(mock_db)
     
     # Mock extract to return invalid data
-    async def mock_extract():
-        return [{"invalid": "data"}]
+    pipeline.extract = AsyncMock(return_value=[{"invalid": "data"}])
     
-    with patch.object(pipeline, 'extract', side_effect=mock_extract):
-        # Transform should handle invalid data gracefully
-        raw_data = await pipeline.extract()
-        transformed = await pipeline.transform(raw_data)
-        
-        # Should return empty list for invalid data
-        assert len(transformed) == 0
+    # Transform should handle invalid data gracefully
+    raw_data = await pipeline.extract()
+    transformed = await pipeline.transform(raw_data)
+    
+    # Should return empty list for invalid data
+    assert len(transformed) == 0
 
 @pytest.mark.asyncio
-async def test_idempotent_writes():
+async def test_idempotent_writes(mock_db):
     """Test that duplicate records are not inserted"""
-    mock_db = MockDatabase()
     
     # Create duplicate records
     record = {
         "source": "test",
         "symbol": "BTC",
         "name": "Bitcoin",
-        "price_usd": Decimal("45000"),
+        "price_usd": 45000.0,
         "last_updated": datetime.now(),
-        "raw_data": {}
+        "raw_bytes": b"{}"
     }
     
     # Insert twice
@@ -355,18 +710,15 @@ async def test_idempotent_writes():
     await mock_db.save_normalized_data([record])
     final_count = len(mock_db.data)
     
-    # Note: In real implementation with DB constraints, count should stay same
-    # In mock, we just verify the mechanism is in place
-    assert final_count >= initial_count
+    assert final_count == initial_count
 
 # ========================================
 # Schema Mismatch Tests
 # ========================================
 
 @pytest.mark.asyncio
-async def test_schema_drift_detection():
+async def test_schema_drift_detection(mock_db):
     """Test schema drift detection with fuzzy matching"""
-    mock_db = MockDatabase()
     pipeline = CoinPaprikaPipeline(mock_db)
     
     # Data with schema drift (renamed field)
@@ -381,60 +733,155 @@ async def test_schema_drift_detection():
     # Should detect the drift but not crash
     await pipeline.detect_schema_drift(drifted_data)
     
-    # Verify it logged the drift
-    # (In real implementation, check schema_drift_logs table)
+    # "ticker" is a known alias, so the rename is reported with certainty
+    assert mock_db.drift_logs[0]["warnings"] == [
+        "Field rename: 'symbol' -> 'ticker' (known alias)"
+    ]
+
+@pytest.mark.asyncio
+async def test_schema_drift_skipped_for_unchanged_schema(mock_db):
+    """Test drift check only re-runs when the sample's keys or types change"""
+    pipeline = CoinPaprikaPipeline(mock_db)
+    
+    drifted_data = {
+        "id": "btc",
+        "name": "Bitcoin",
+        "symbl": "BTC",  # Typo'd rename of "symbol"
+        "rank": 1,
+        "quotes": {"USD": {"price": 45000}}
+    }
+    
+    await pipeline.detect_schema_drift(drifted_data)
+    assert len(mock_db.drift_logs) == 1
+    
+    # Same keys and value types - nothing is recomputed or logged
+    await pipeline.detect_schema_drift(dict(drifted_data, rank=2))
+    assert len(mock_db.drift_logs) == 1
+    
+    # A type change invalidates the cached signature
+    await pipeline.detect_schema_drift(dict(drifted_data, rank="2"))
+    assert len(mock_db.drift_logs) == 2
 
 # ========================================
 # Rate Limiting Tests
 # ========================================
 
 @pytest.mark.asyncio
-async def test_backoff_calculation():
+async def test_backoff_calculation(mock_db):
     """Test exponential backoff calculation"""
-    mock_db = MockDatabase()
     pipeline = CoinPaprikaPipeline(mock_db)
     
-    # Test backoff delays
-    delay_0 = await pipeline.calculate_backoff(0)
-    delay_1 = await pipeline.calculate_backoff(1)
-    delay_2 = await pipeline.calculate_backoff(2)
+    # Enough attempts to reach the cap
+    delays = await asyncio.gather(*(pipeline.calculate_backoff(i) for i in range(8)))
     
-    assert delay_1 > delay_0
-    assert delay_2 > delay_1
-    assert delay_2 <= 60.0  # Should respect max delay
+    assert delays[0] < delays[1] < delays[2]
+    assert all(a <= b for a, b in pairwise(delays))  # Never shrinks
+    assert max(delays) == settings.BACKOFF_MAX_DELAY  # Should respect max delay
+
+@pytest.mark.asyncio
+async def test_rate_limiter_allows_burst_then_throttles():
+    """Test token bucket only waits once the budget is spent"""
+    # Drive the limiter's clock by hand and record the sleeps it asks for
+    with patch("ingestion.rate_limiter.time") as fake_time, \
+            patch("ingestion.rate_limiter.asyncio") as fake_asyncio:
+        fake_time.monotonic.return_value = 100.0
+        fake_asyncio.sleep = AsyncMock()
+        limiter = AsyncRateLimiter(max_rate=2, time_period=0.2)  # 10 per second
+        
+        await limiter.acquire()
+        await limiter.acquire()
+        fake_asyncio.sleep.assert_not_awaited()  # Full bucket - no waiting
+        
+        await limiter.acquire()
+        assert fake_asyncio.sleep.await_args.args[0] == pytest.approx(0.1)  # One token's refill
+        
+        await limiter.acquire()
+        assert fake_asyncio.sleep.await_args.args[0] == pytest.approx(0.2)  # Queued behind the third
+        
+        # Once the refill covers the reservations, calls go straight through again
+        fake_time.monotonic.return_value = 100.5
+        await limiter.acquire()
+        assert fake_asyncio.sleep.await_count == 2
 
 # ========================================
 # Integration Tests
 # ========================================
 
 @pytest.mark.asyncio
-async def test_full_etl_orchestration():
+async def test_full_etl_orchestration(mock_db):
     """Test full ETL orchestration"""
-    mock_db = MockDatabase()
     orchestrator = ETLOrchestrator(mock_db)
     
-    # Mock all pipelines to return success
-    for source, pipeline in orchestrator.pipelines.items():
-        async def mock_run():
-            return {
-                "status": "success",
-                "records_processed": 10,
-                "duration": 1.0
-            }
+    # Mock all pipelines to return success after yielding to the loop,
+    # counting how many are running at once
+    in_flight = 0
+    max_in_flight = 0
+    
+    async def mock_run():
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        return {
+            "status": "success",
+            "records_processed": 10,
+            "duration": 0.1
+        }
+    
+    for pipeline in orchestrator.pipelines.values():
         pipeline.run = mock_run
     
     # Run full ETL
     result = await orchestrator.run_full_etl()
     
-    assert result["status"] in ["success", "partial_failure"]
-    assert result["total_records"] >= 0
+    assert result["status"] == "success"
+    assert result["total_records"] == 30
     assert "duration_seconds" in result
+    assert max_in_flight == 3  # Sources run concurrently, not back to back
+    assert mock_db.stats_refreshes == 1  # Once for all sources
 
 @pytest.mark.asyncio
-async def test_etl_recovery_after_failure():
+async def test_single_source_run_refreshes_stats(mock_db):
+    """Test a single-source run asks its pipeline to refresh the stats"""
+    orchestrator = ETLOrchestrator(mock_db)
+    pipeline = orchestrator.pipelines["csv"]
+    pipeline.run = AsyncMock(return_value={"status": "success", "records_processed": 5, "duration": 0.1})
+    
+    result = await orchestrator.run_single_source("csv")
+    
+    assert result["records_processed"] == 5
+    pipeline.run.assert_awaited_once_with(refresh_stats=True)
+
+@pytest.mark.asyncio
+async def test_full_etl_isolates_source_failures(mock_db):
+    """Test one failing source doesn't stop the others running concurrently"""
+    orchestrator = ETLOrchestrator(mock_db)
+    
+    async def mock_run():
+        return {"status": "success", "records_processed": 10, "duration": 1.0}
+    
+    async def failing_run():
+        raise Exception("API down")
+    
+    for source, pipeline in orchestrator.pipelines.items():
+        pipeline.run = failing_run if source == "coingecko" else mock_run
+    
+    result = await orchestrator.run_full_etl()
+    
+    assert result["status"] == "partial_failure"
+    assert result["failed_sources"] == ["coingecko"]
+    assert result["sources"]["coingecko"]["error"] == "API down"
+    assert result["total_records"] == 20
+
+@pytest.mark.asyncio
+async def test_etl_recovery_after_failure(mock_db):
     """Test ETL resumes from checkpoint after failure"""
-    mock_db = MockDatabase()
-    pipeline = CoinPaprikaPipeline(mock_db)
+    # Stub HTTP session returning an empty ticker list
+    response = Mock(status=200, read=AsyncMock(return_value=b"[]"))
+    session = MagicMock(closed=False)
+    session.get.return_value.__aenter__.return_value = response
+    pipeline = CoinPaprikaPipeline(mock_db, session)
     
     # Save a checkpoint as if previous run failed midway
     await mock_db.save_checkpoint(
@@ -443,33 +890,33 @@ async def test_etl_recovery_after_failure():
         records_processed=50
     )
     
-    # Mock extract to check for checkpoint
-    original_extract = pipeline.extract
-    extract_called_with_checkpoint = False
-    
-    async def mock_extract_with_check():
-        checkpoint = await mock_db.get_last_checkpoint("coinpaprika")
-        nonlocal extract_called_with_checkpoint
-        if checkpoint:
-            extract_called_with_checkpoint = True
-        return []
-    
-    pipeline.extract = mock_extract_with_check
-    
-    await pipeline.extract()
+    # Run the real extract with the checkpoint read wrapped
+    with patch.object(MockDatabase, "get_last_checkpoint", autospec=True,
+                      side_effect=MockDatabase.get_last_checkpoint) as get_last_checkpoint:
+        assert await pipeline.extract() == []
     
     # Verify checkpoint was checked
-    assert extract_called_with_checkpoint
+    get_last_checkpoint.assert_awaited_once_with(mock_db, "coinpaprika")
 
 # ========================================
 # Test Configuration
 # ========================================
 
-@pytest.fixture(autouse=True)
-def reset_mock_db():
-    """Reset mock database before each test"""
-    yield
-    # Cleanup if needed
+@pytest.fixture(scope="module")
+def shared_mock_db():
+    """One MockDatabase for the whole module"""
+    return MockDatabase()
+
+@pytest.fixture
+def mock_db(shared_mock_db):
+    """The shared mock database, emptied after each test"""
+    yield shared_mock_db
+    shared_mock_db.clear()
+
+@pytest.fixture
+def failing_extract():
+    """Extract stand-in that fails like a network outage"""
+    return AsyncMock(side_effect=Exception("Network error"))
 
 if __name__ == "__main__":
-    pytest.main([__file__, "-v", "--cov=.", "--cov-report=term-missing"])
\ No newline at end of file
+    pytest.main([__file__])
\ No newline at end of file